@@ -11,10 +11,30 @@ import dotenv
 import jsonlines
 import json
 import csv
-from flask import Flask, render_template
+import sqlite3
+import random
+import threading
+import queue
+import uuid
+import bisect
+import gzip
+import zlib
+import math
+import mmap
+import itertools
+from array import array
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from requests.adapters import HTTPAdapter
+from flask import Flask, render_template, request, Response
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from stravalib.client import Client
+try:
+    import numpy  # optional, decodes the polylines of a load at once
+except ImportError:
+    numpy = None
 
 dotenv.load_dotenv()  # Load environment variables from .env file
 
@@ -26,10 +46,34 @@ REDIRECT_URL = 'http://localhost:8000/authorized'
 PATH = os.path.dirname(os.path.abspath(__file__))
 json_path = os.path.join(PATH, 'activities-all.json')
 client_path = os.path.join(PATH, 'client.pkl')
+index_path = os.path.join(PATH, 'activities-index.sqlite')
+columns_path = os.path.join(PATH, 'columns')
+SYNC_BATCH = 200  # activities appended to the file at once, one page of the Strava API
+STRAVA_API = os.getenv("STRAVA_API", "https://www.strava.com/api/v3")  # can point to a local stub server
+STREAM_KEYS = "time,latlng,distance,altitude,heartrate,cadence"
+SIMPLIFY_ZOOMS = (8, 10, 12, 14, 16)  # Leaflet zooms with precomputed simplified routes, full routes above
+GRID_CELL = 0.25  # size in degrees of the cells of the spatial index
+COLUMNS = {  # fields of the column store and their array type
+    'id': 'q',
+    'start_date': 'q',  # seconds since the epoch
+    'distance': 'd',
+    'moving_time': 'd',
+    'elapsed_time': 'd',
+    'total_elevation_gain': 'd',
+    'elev_high': 'd',
+    'elev_low': 'd',
+    'average_speed': 'd',
+    'max_speed': 'd',
+    'average_heartrate': 'd',
+    'max_heartrate': 'd',
+    'calories': 'd',
+}
 
 app = FastAPI()
 app_flask = Flask(__name__)
 client = Client()
+client_lock = threading.Lock()  # the client is shared by the request threads and the refresh worker
+client_loaded = False
 
 def save_object(obj, filename):
     with open(filename, 'wb') as output:
@@ -39,12 +83,13 @@ def load_object(filename):
     with open(filename, 'rb') as input:
         return pickle.load(input)
 
-def check_token():
-    if time.time() > client.token_expires_at:
+def check_token(force=False):
+    if force or time.time() > client.token_expires_at:
         refresh_response = client.refresh_access_token(client_id=CLIENT_ID, client_secret=CLIENT_SECRET, refresh_token=client.refresh_token)
         client.access_token = refresh_response['access_token']
         client.refresh_token = refresh_response['refresh_token']
         client.token_expires_at = refresh_response['expires_at']
+        save_object(client, client_path)  # keep the new token for the next start
 
 @app.get("/")
 def read_root():
@@ -59,6 +104,8 @@ def get_code(state=None, code=None, scope=None):
         client.refresh_token = token_response['refresh_token']
         client.token_expires_at = token_response['expires_at']
         save_object(client, os.path.join(PATH, 'client.pkl'))
+        global client_loaded
+        client_loaded = True
         return {"state": state, "code": code, "scope": scope}
     except Exception as e:
         return {f'Error: {e} line {e.__traceback__.tb_lineno}'}
@@ -66,86 +113,850 @@ def get_code(state=None, code=None, scope=None):
 def get_num(num):
     return float(str(num).split()[0])
 
-def get_activities():
+def open_index():
+    db = sqlite3.connect(index_path)
+    db.execute("CREATE TABLE IF NOT EXISTS activities (id INTEGER PRIMARY KEY, start_date TEXT NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+    if any(column[1] == 'offset' for column in db.execute("PRAGMA table_info(activities)")):  # index of a previous version
+        db.execute("ALTER TABLE activities DROP COLUMN offset")
+        db.commit()
+    return db
+
+def get_state(db, key, default=None):
+    row = db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def set_state(db, key, value):
+    db.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, str(value)))
+
+def reconcile_index(db):
+    # Index the lines written to the file after the last commit of the index
+    # (first run on an existing file, or a sync interrupted between the write and the commit)
+    size = os.path.getsize(json_path) if os.path.exists(json_path) else 0
+    indexed = int(get_state(db, 'file_size', 0))
+    if size == indexed:
+        return
+    if size < indexed:  # the file was replaced, index it again
+        db.execute("DELETE FROM activities")
+        indexed = 0
+    with open(json_path, 'rb') as file:
+        file.seek(indexed)
+        offset = indexed
+        for line in file:
+            if not line.endswith(b'\n'):  # a partial last line left by a crash, dropped by the next append
+                break
+            if line.strip():
+                activity = json.loads(line)
+                db.execute("INSERT OR IGNORE INTO activities (id, start_date) VALUES (?, ?)", (activity['id'], activity['start_date']))
+            offset += len(line)
+    set_state(db, 'file_size', offset)
+    db.commit()
+
+def activity_record(activity):
+    return {
+        "id": activity.id,
+        "distance": get_num(activity.distance),
+        "moving_time": activity.moving_time.seconds,
+        "elapsed_time": activity.elapsed_time.seconds,
+        "total_elevation_gain": get_num(activity.total_elevation_gain),
+        "elev_high": activity.elev_high,
+        "elev_low": activity.elev_low,
+        "average_speed": get_num(activity.average_speed),
+        "max_speed": get_num(activity.max_speed),
+        "average_heartrate": activity.average_heartrate,
+        "max_heartrate": activity.max_heartrate,
+        "start_date": str(activity.start_date),
+        "name": activity.name,
+        "calories": activity.calories,
+        "polyline": activity.map.summary_polyline,
+    }
+
+def append_activities(db, records):
+    # All the new lines are written in one append, then the index is committed:
+    # if the program stops in between, reconcile_index picks the lines up on the next run
+    lines = [(json.dumps(record) + '\n').encode() for record in records]
+    with open(json_path, 'ab') as file:
+        file.truncate(int(get_state(db, 'file_size', 0)))  # drop a partial line after the last indexed one
+        file.seek(0, os.SEEK_END)
+        file.write(b''.join(lines))
+        file.flush()
+        os.fsync(file.fileno())
+        size = file.tell()
+    db.executemany("INSERT OR IGNORE INTO activities (id, start_date) VALUES (?, ?)", [(record['id'], record['start_date']) for record in records])
+    set_state(db, 'file_size', size)
+    db.commit()
+
+def get_activities(job=None):
+    # job is the RefreshJob to report the progress to, when the refresh runs in the background
+    saved = 0
     try:
-        if os.path.exists(os.path.join(PATH, 'client.pkl')):
-            global client
-            client = load_object(os.path.join(PATH, 'client.pkl'))
-        check_token()
+        load_client()
         athlete = client.get_athlete()
         print(f"For {athlete.id}, I now have an access token {client.access_token}")
 
-        existing_activities = set()
-        if os.path.exists(json_path):
-            with jsonlines.open(json_path, mode='r') as reader:
-                for line in reader:
-                    existing_activities.add(line['id'])
-
-        with jsonlines.open(json_path, mode='w') as writer:
-            for activity in client.get_activities():
-                '''with open('test.txt', 'w') as f:
-                    f.write(str(activity))
-                    test = activity.end_latlng
-                    print(str(test), type(test))
-                break'''
-                if activity.id in existing_activities:
+        db = open_index()
+        try:
+            reconcile_index(db)
+            last_start_date = db.execute("SELECT MAX(start_date) FROM activities").fetchone()[0]
+            # Strava returns the pages oldest first when after is given, so the first crawl starts
+            # from the epoch: if it stops, MAX(start_date) is still a valid cursor for the next run
+            after = datetime.fromisoformat(last_start_date) if last_start_date else datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+            new_activities = []
+            seen = 0
+            if job is not None:
+                job.update(pages=1)  # the first page is fetched even when there is no new activity
+            for activity in client.get_activities(after=after):  # only the activities newer than the last one synced
+                if job is not None and seen and seen % SYNC_BATCH == 0:  # first activity of a new page
+                    job.update(pages=seen // SYNC_BATCH + 1)
+                seen += 1
+                if db.execute("SELECT 1 FROM activities WHERE id = ?", (activity.id,)).fetchone():
                     print(f'Activity {activity.id} already exists, skipping.')
                     continue
                 print('New activity:', activity.id)
-                writer.write({
-                    "id": activity.id,
-                    "distance": get_num(activity.distance),
-                    "moving_time": activity.moving_time.seconds,
-                    "elapsed_time": activity.elapsed_time.seconds,
-                    "total_elevation_gain": get_num(activity.total_elevation_gain),
-                    "elev_high": activity.elev_high,
-                    "elev_low": activity.elev_low,
-                    "average_speed": get_num(activity.average_speed),
-                    "max_speed": get_num(activity.max_speed),
-                    "average_heartrate": activity.average_heartrate,
-                    "max_heartrate": activity.max_heartrate,
-                    "start_date": str(activity.start_date),
-                    "name": activity.name,
-                    "calories": activity.calories,
-                    "polyline": activity.map.summary_polyline,
-                })
-                #
-        print(f'Activities saved in {json_path} at {time.ctime()} on {time.strftime("%d/%m/%Y")}')
+                new_activities.append(activity_record(activity))
+                if len(new_activities) == SYNC_BATCH:  # keep what is fetched if a later page fails
+                    append_activities(db, new_activities)
+                    saved += len(new_activities)
+                    new_activities = []
+                    if job is not None:
+                        job.update(new_activities=saved)
+            if new_activities:
+                append_activities(db, new_activities)
+                saved += len(new_activities)
+            if job is not None:
+                if seen and seen % SYNC_BATCH == 0:  # the last page was full, so an empty one was fetched after it
+                    job.update(pages=seen // SYNC_BATCH + 1)
+                job.update(new_activities=saved)
+        finally:
+            db.close()
+            store.invalidate()
+            columns.sync(json_path)
+        print(f'{saved} new activities saved in {json_path} at {time.ctime()} on {time.strftime("%d/%m/%Y")}')
     except FileNotFoundError as e:
         print("No access token stored yet, run `uvicorn authenticate:app --reload` and visit http://localhost:8000/ to get it")
         print("After visiting that URL, a pickle file is stored. Run this file again to download your activities.")
         print()
+        if job is not None:
+            job.add_error('No access token stored yet')
+    except Exception as e:
+        print(f'Error: {e} line {e.__traceback__.tb_lineno}')
+        if job is not None:
+            job.add_error(f'Error: {e} line {e.__traceback__.tb_lineno}')
+    return saved
+
+class RefreshJob:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.changed = threading.Condition()
+        self.version = 0  # incremented on every change, for the event stream
+        self.status = {
+            'id': self.id,
+            'state': 'queued',
+            'created': time.time(),
+            'started': None,
+            'finished': None,
+            'pages': 0,
+            'new_activities': 0,
+            'errors': [],
+        }
+
+    def update(self, **fields):
+        with self.changed:
+            self.status.update(fields)
+            self.version += 1
+            self.changed.notify_all()
+
+    def add_error(self, message):
+        with self.changed:
+            self.status['errors'].append(message)
+            self.version += 1
+            self.changed.notify_all()
+
+    def snapshot(self):
+        with self.changed:
+            return self.version, dict(self.status, errors=list(self.status['errors']))
+
+    def wait(self, version, timeout):
+        # Block until the job changes after version, or timeout
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+        return self.snapshot()
+
+    @property
+    def active(self):
+        return self.status['state'] in ('queued', 'running')
+
+class RefreshQueue:
+    # A single worker thread runs the refreshes one after the other. A refresh asked while
+    # another one is queued or running gets the id of that one instead of starting a new crawl.
+    def __init__(self, keep=20):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.keep = keep
+        self.current = None
+        self.queue = queue.Queue()
+        self.worker = None
+
+    def submit(self):
+        with self.lock:
+            if self.current is not None and self.current.active:
+                return self.current.id
+            job = RefreshJob()
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.keep:  # forget the oldest jobs
+                del self.jobs[next(iter(self.jobs))]
+            self.current = job
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, name='refresh-worker', daemon=True)
+                self.worker.start()
+            self.queue.put(job)
+            return job.id
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            job.update(state='running', started=time.time())
+            try:
+                get_activities(job)
+            except Exception as e:
+                job.add_error(f'Error: {e} line {e.__traceback__.tb_lineno}')
+            job.update(state='failed' if job.status['errors'] else 'done', finished=time.time())
+
+refresh_jobs = RefreshQueue()
+
+class RateLimiter:
+    # Token buckets for the two Strava read quotas (all the requests here are GET): the 15 minutes one
+    # (refilled at :00, :15, :30 and :45) and the daily one (refilled at midnight UTC).
+    # The usage reported in the response headers is kept when it is higher than the local count,
+    # so other programs using the same application are taken into account, while the requests
+    # still in flight, not counted by Strava yet, are not forgotten.
+    def __init__(self, short_limit=100, daily_limit=1000):
+        self.lock = threading.Lock()
+        self.limits = [short_limit, daily_limit]
+        self.usage = [0, 0]
+        self.resets = [0, 0]
+
+    def _windows(self, now):
+        short_reset = now - now % 900 + 900
+        daily_reset = now - now % 86400 + 86400
+        return [short_reset, daily_reset]
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                for i, reset in enumerate(self._windows(now)):
+                    if reset != self.resets[i]:  # a new window, the bucket is full again
+                        self.resets[i] = reset
+                        self.usage[i] = 0
+                full = [self.resets[i] for i in range(2) if self.usage[i] >= self.limits[i]]
+                if not full:
+                    self.usage[0] += 1
+                    self.usage[1] += 1
+                    return
+                wait = max(full) - now
+            time.sleep(min(wait, 60))
+
+    def update(self, headers):
+        # The read quota when Strava reports it, the overall quota otherwise
+        limits = headers.get('X-ReadRateLimit-Limit') or headers.get('X-RateLimit-Limit')
+        usage = headers.get('X-ReadRateLimit-Usage') or headers.get('X-RateLimit-Usage')
+        if not limits or not usage:
+            return
+        with self.lock:
+            self.limits = [int(value) for value in limits.split(',')[:2]]
+            self.usage = [max(local, int(value)) for local, value in zip(self.usage, usage.split(',')[:2])]
+
+    def exhausted(self):
+        # After a 429, the next acquire() waits for the reset of the window (the 15 minutes one,
+        # unless the reported usage already shows that the daily one is full)
+        with self.lock:
+            if all(self.usage[i] < self.limits[i] for i in range(2)):
+                self.usage[0] = self.limits[0]
+
+def api_get(session, limiter, url, params=None, retries=5, get_token=None):
+    # get_token returns the access token sent with each request (refreshed when it expires).
+    # After a 401 it is called with the rejected token to refresh it, and the request is sent again once.
+    rejected = None
+    for attempt in range(retries + 1):
+        token = get_token(rejected) if get_token is not None else None
+        headers = {'Authorization': f'Bearer {token}'} if token else None
+        limiter.acquire()
+        try:
+            response = session.get(url, params=params, headers=headers, timeout=30)
+        except requests.RequestException:
+            if attempt == retries:
+                raise
+        else:
+            limiter.update(response.headers)
+            if response.status_code == 401 and token and rejected is None and attempt < retries:
+                rejected = token
+                if get_token(rejected) != token:  # a new token, send the request again
+                    continue
+            if response.status_code != 429 and response.status_code < 500:
+                response.raise_for_status()
+                return response.json()
+            if attempt == retries:
+                response.raise_for_status()
+            if response.status_code == 429:  # the quota is used, acquire() waits for the next window
+                limiter.exhausted()
+                continue
+        time.sleep(min(60, 2 ** attempt) + random.random())  # exponential backoff with jitter
+
+def fetch_activity(session, limiter, activity_id, base_url=STRAVA_API, get_token=None):
+    detail = api_get(session, limiter, f'{base_url}/activities/{activity_id}', get_token=get_token)
+    streams = api_get(session, limiter, f'{base_url}/activities/{activity_id}/streams', params={'keys': STREAM_KEYS, 'key_by_type': 'true'}, get_token=get_token)
+    return detail, streams
+
+def load_client(rejected_token=None):
+    # The pickled client is loaded once, then only its token is refreshed when it expires,
+    # or when the API rejected it (once, even if several requests were rejected with the same token)
+    global client, client_loaded
+    with client_lock:
+        if not client_loaded:
+            client = load_object(client_path)  # FileNotFoundError if no token was stored yet
+            client_loaded = True
+        check_token(force=rejected_token is not None and rejected_token == client.access_token)
+        return client
+
+def client_token(rejected_token=None):
+    return load_client(rejected_token).access_token
+
+def fetch_details(ids=None, workers=8, base_url=STRAVA_API, access_token=None, limiter=None):
+    # Fetch the detail and the streams of the indexed activities on a thread pool.
+    # Each result is committed as soon as it arrives, so a new run only fetches what is missing.
+    try:
+        # Without an explicit token, the token of the client is read for each request, so it is refreshed during a long run
+        get_token = client_token if access_token is None else lambda rejected_token=None: access_token
+        get_token()  # fail before the pool if there is no client
+        limiter = limiter or RateLimiter()
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        db = open_index()
+        try:
+            db.execute("CREATE TABLE IF NOT EXISTS details (id INTEGER PRIMARY KEY, detail TEXT NOT NULL, streams TEXT NOT NULL, fetched_at TEXT NOT NULL)")
+            reconcile_index(db)
+            if ids is None:
+                ids = [row[0] for row in db.execute("SELECT id FROM activities WHERE id NOT IN (SELECT id FROM details) ORDER BY start_date DESC")]
+            else:
+                done = {row[0] for row in db.execute("SELECT id FROM details")}
+                ids = [activity_id for activity_id in ids if activity_id not in done]
+            print(f'{len(ids)} activities to fetch with {workers} workers')
+
+            fetched, errors = 0, 0
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(fetch_activity, session, limiter, activity_id, base_url, get_token): activity_id for activity_id in ids}
+                for future in as_completed(futures):
+                    activity_id = futures[future]
+                    try:
+                        detail, streams = future.result()
+                    except Exception as e:
+                        errors += 1
+                        print(f'Error for activity {activity_id}: {e}')
+                        continue
+                    db.execute("INSERT OR REPLACE INTO details (id, detail, streams, fetched_at) VALUES (?, ?, ?, ?)",
+                               (activity_id, json.dumps(detail), json.dumps(streams), datetime.now(timezone.utc).isoformat()))
+                    db.commit()
+                    fetched += 1
+        finally:
+            db.close()
+            session.close()
+        print(f'{fetched} activities fetched, {errors} errors')
+        return fetched, errors
     except Exception as e:
         print(f'Error: {e} line {e.__traceback__.tb_lineno}')
 
+POLYLINE_CONTINUATION = ''.join(chr(byte + 63) for byte in range(0x20, 0x40))  # chunks followed by another chunk of the same value
+
+def decode_polylines(polylines):
+    # Google encoded polylines -> one array('d') of lat, lng, lat, lng... per polyline, 16 bytes per point.
+    # A truncated polyline keeps its complete points. With numpy, the chunks of all the polylines are
+    # decoded at once; without it, the characters are read as bytes in a loop.
+    polylines = [polyline.rstrip(POLYLINE_CONTINUATION) if polyline else '' for polyline in polylines]
+    if numpy is not None and any(polylines):
+        return decode_polylines_numpy(polylines)
+    decoded = []
+    for polyline in polylines:
+        points = array('d')
+        if polyline:
+            values = []
+            result, shift = 0, 0
+            for byte in polyline.encode():
+                byte -= 63
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:  # last chunk of a value
+                    values.append(~(result >> 1) if result & 1 else result >> 1)
+                    result, shift = 0, 0
+            lats = itertools.accumulate(values[0::2])  # the values are deltas from the previous point
+            lngs = itertools.accumulate(values[1::2])
+            points = array('d', (value / 1e5 for pair in zip(lats, lngs) for value in pair))
+        decoded.append(points)
+    return decoded
+
+def decode_polylines_numpy(polylines):
+    # The polylines have no incomplete value at their end (see decode_polylines), so each chunk
+    # belongs to a value of its own polyline: the values are the sums of their chunks shifted by 5 bits each
+    chunks = numpy.frombuffer(''.join(polylines).encode('ascii'), dtype=numpy.uint8).astype(numpy.int64) - 63
+    ends = chunks < 0x20  # last chunk of a value
+    value_ends = numpy.flatnonzero(ends)
+    value_starts = numpy.concatenate(([0], value_ends[:-1] + 1))
+    value_index = numpy.cumsum(ends) - ends
+    shifts = 5 * (numpy.arange(len(chunks)) - value_starts[value_index])
+    values = numpy.add.reduceat((chunks & 0x1f) << shifts, value_starts)
+    values = numpy.where(values & 1, ~(values >> 1), values >> 1)
+    # first value of each polyline: the number of value ends before its first byte
+    byte_bounds = numpy.concatenate(([0], numpy.cumsum([len(polyline) for polyline in polylines])))
+    value_bounds = numpy.concatenate(([0], numpy.cumsum(ends)))[byte_bounds]
+    decoded = []
+    for first, last in zip(value_bounds[:-1], value_bounds[1:]):
+        deltas = values[first:first + (last - first) // 2 * 2].reshape(-1, 2)  # the deltas from the previous point
+        points = array('d')
+        points.frombytes((numpy.cumsum(deltas, axis=0) / 1e5).tobytes())
+        decoded.append(points)
+    return decoded
+
+def decode_polyline(polyline):
+    points = decode_polylines([polyline])[0]
+    return list(zip(points[0::2], points[1::2]))
+
+def encode_polyline(points):
+    chunks = []
+    previous_lat, previous_lng = 0, 0
+    for i in range(0, len(points), 2):
+        lat, lng = round(points[i] * 1e5), round(points[i + 1] * 1e5)
+        for value in (lat - previous_lat, lng - previous_lng):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        previous_lat, previous_lng = lat, lng
+    return ''.join(chunks)
+
+def points_bbox(points):
+    if not points:
+        return None
+    lats, lngs = points[0::2], points[1::2]
+    return min(lngs), min(lats), max(lngs), max(lats)  # west, south, east, north like Leaflet's toBBoxString
+
+def simplify(points, tolerance):
+    # Douglas-Peucker on a flat lat, lng array, with an explicit stack instead of recursion
+    count = len(points) // 2
+    if count < 3:
+        return points
+    keep = bytearray(count)
+    keep[0] = keep[-1] = 1
+    tolerance2 = tolerance * tolerance
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = points[2 * first], points[2 * first + 1]
+        dx, dy = points[2 * last] - ax, points[2 * last + 1] - ay
+        norm = dx * dx + dy * dy
+        farthest, distance = first, -1.0
+        for i in range(first + 1, last):
+            px, py = points[2 * i] - ax, points[2 * i + 1] - ay
+            if norm:
+                cross = px * dy - py * dx
+                d = cross * cross / norm
+            else:
+                d = px * px + py * py
+            if d > distance:
+                farthest, distance = i, d
+        if distance > tolerance2:
+            keep[farthest] = 1
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return array('d', (value for i in range(count) if keep[i] for value in (points[2 * i], points[2 * i + 1])))
+
+def zoom_tolerance(zoom):
+    return 360 / (256 * 2 ** zoom)  # degrees covered by one pixel of a Leaflet tile at this zoom
+
+def grid_cells(bbox):
+    west, south, east, north = bbox
+    return itertools.product(range(math.floor(west / GRID_CELL), math.floor(east / GRID_CELL) + 1),
+                             range(math.floor(south / GRID_CELL), math.floor(north / GRID_CELL) + 1))
+
+class ActivitySnapshot:
+    # The activities of one version of the JSONL file, sorted by start date, with their decoded polylines,
+    # their bounding boxes and the grid index. A snapshot is never modified once built (except for the
+    # simplified routes and the cached responses, which are added), so a request reads one consistent version.
+    def __init__(self, key, activities):
+        self.key = key
+        self.exists = key is not None
+        self.activities = activities
+        self.dates = [activity['start_date'] for activity in activities]
+        self.points = decode_polylines(activity.get('polyline') for activity in activities)
+        self.bboxes = [points_bbox(points) for points in self.points]
+        self.grid = {}
+        for i, bbox in enumerate(self.bboxes):
+            if bbox:
+                for cell in grid_cells(bbox):
+                    self.grid.setdefault(cell, []).append(i)
+        self.simplified = {}  # zoom -> encoded simplified polyline of each activity
+        self.raw = None
+        self.responses = {}  # cached encoded API responses of this version
+
+    def routes(self, zoom):
+        # Encoded polylines simplified for the closest precomputed zoom at or below zoom
+        # (the coarsest one below it, the full polylines above the last one).
+        # While the background simplification runs, the closest zoom already done is used.
+        if zoom > SIMPLIFY_ZOOMS[-1]:
+            return SIMPLIFY_ZOOMS[-1] + 1, [activity.get('polyline') for activity in self.activities]
+        zoom = max([z for z in SIMPLIFY_ZOOMS if z <= zoom], default=SIMPLIFY_ZOOMS[0])
+        done = sorted(list(self.simplified), key=lambda z: abs(z - zoom))
+        if done:
+            return done[0], self.simplified[done[0]]
+        return SIMPLIFY_ZOOMS[-1] + 1, [activity.get('polyline') for activity in self.activities]
+
+    @property
+    def version(self):
+        # Changes with the file only: /api/routes adds the zoom it used to its ETag
+        return f'{self.key[0]:x}-{self.key[1]:x}' if self.key else 'empty'
+
+    def text(self):
+        if self.raw is None:
+            self.raw = ''.join(json.dumps(activity) + '\n' for activity in self.activities)
+        return self.raw
+
+    def query(self, after=None, before=None, bbox=None):
+        # Indexes of the activities started in [after, before) that intersect bbox, newest first
+        start = bisect.bisect_left(self.dates, after) if after else 0
+        end = bisect.bisect_left(self.dates, before) if before else len(self.dates)
+        if not bbox:
+            return list(range(end - 1, start - 1, -1))
+        west, south, east, north = bbox
+        if (east - west) * (north - south) / GRID_CELL ** 2 > len(self.grid):  # more cells to look at than filled ones
+            candidates = range(start, end)
+        else:
+            candidates = {i for cell in grid_cells(bbox) for i in self.grid.get(cell, ()) if start <= i < end}
+        return sorted((i for i in candidates if self.bboxes[i] and self.bboxes[i][0] <= east and self.bboxes[i][2] >= west
+                       and self.bboxes[i][1] <= north and self.bboxes[i][3] >= south), reverse=True)
+
+class ActivityStore:
+    # The current ActivitySnapshot of the JSONL file, built again when its mtime or size changes,
+    # or after invalidate() (called by a sync). load() swaps the whole snapshot under the lock,
+    # so the request handlers read every list of the same version from the snapshot it returns.
+    # The routes are simplified for each zoom of SIMPLIFY_ZOOMS by a background thread started after each load.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.key = None
+        self.snapshot = ActivitySnapshot(None, [])
+
+    def invalidate(self):
+        with self.lock:
+            self.key = None
+
+    def load(self):
+        try:
+            stat = os.stat(self.path)
+            key = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            key = None
+        with self.lock:
+            if key is not None and key == self.key:
+                return self.snapshot
+            activities = []
+            if key is not None:
+                with jsonlines.open(self.path, mode='r') as reader:
+                    activities = list(reader)
+            activities.sort(key=lambda activity: activity['start_date'])
+            snapshot = ActivitySnapshot(key, activities)
+            self.snapshot = snapshot
+            self.key = key
+        threading.Thread(target=self.simplify_routes, args=(snapshot,), daemon=True).start()
+        return snapshot
+
+    def simplify_routes(self, snapshot):
+        # Simplify the routes for each zoom, coarsest first, so no request waits for it.
+        # Stops if the file was loaded again meanwhile.
+        for zoom in SIMPLIFY_ZOOMS:
+            simplified = [encode_polyline(simplify(route, zoom_tolerance(zoom))) for route in snapshot.points]
+            with self.lock:
+                if self.snapshot is not snapshot:
+                    return
+                snapshot.simplified[zoom] = simplified
+
+store = ActivityStore(json_path)
+
+def week_start(date):
+    return (date - timedelta(days=date.weekday())).strftime('%Y-%m-%d')
+
+def parse_date(start_date):
+    date = datetime.fromisoformat(start_date)
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+def add_to_rollup(rollups, key, record):
+    rollup = rollups.setdefault(key, {'count': 0, 'distance': 0.0, 'moving_time': 0.0, 'elevation_gain': 0.0, 'heartrate_time': 0.0, 'heartrate_seconds': 0.0})
+    rollup['count'] += 1
+    rollup['distance'] += record.get('distance') or 0.0
+    rollup['moving_time'] += record.get('moving_time') or 0.0
+    rollup['elevation_gain'] += record.get('total_elevation_gain') or 0.0
+    if record.get('average_heartrate') and record.get('moving_time'):  # averaged over the moving time
+        rollup['heartrate_time'] += record['average_heartrate'] * record['moving_time']
+        rollup['heartrate_seconds'] += record['moving_time']
+
+class ColumnStore:
+    # The activities stored by column: one file of 8 bytes values per field of COLUMNS
+    # ('q' for integers, 'd' for floats with NaN for missing values), read through mmap.
+    # meta.json holds the number of rows, the size of the JSONL file already converted
+    # and the weekly and monthly rollups, which are updated with the new rows only.
+    # sync() converts the lines appended to the JSONL file since the last call,
+    # so the first call is the migration of the whole file.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.meta = None
+        self.views = {}  # cached views, dropped on sync: the ones callers hold keep their mmap until released
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f'{name}.{COLUMNS[name]}')
+
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self.path, 'meta.json')) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {'rows': 0, 'file_size': 0, 'week': {}, 'month': {}}
+
+    def _write_meta(self, meta):
+        meta_path = os.path.join(self.path, 'meta.json')
+        with open(meta_path + '.tmp', 'w') as file:
+            json.dump(meta, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(meta_path + '.tmp', meta_path)  # the new rows are visible only once meta.json is replaced
+
+    def sync(self, source=json_path):
+        with self.lock:
+            size = os.path.getsize(source) if os.path.exists(source) else 0
+            if self.meta is not None and size == self.meta['file_size']:  # nothing appended since the last sync
+                return 0
+            os.makedirs(self.path, exist_ok=True)
+            meta = self._read_meta()
+            if size < meta['file_size']:  # the JSONL file was replaced, convert it again
+                meta = {'rows': 0, 'file_size': 0, 'week': {}, 'month': {}}
+            if size == meta['file_size']:
+                self.meta = meta
+                return 0
+            columns = {name: array(code) for name, code in COLUMNS.items()}
+            offset = meta['file_size']
+            with open(source, 'rb') as file:
+                file.seek(offset)
+                for line in file:
+                    if not line.endswith(b'\n'):  # a line being written, converted on the next sync
+                        break
+                    offset += len(line)
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    date = parse_date(record['start_date'])
+                    for name, column in columns.items():
+                        if name == 'start_date':
+                            column.append(int(date.timestamp()))
+                        elif COLUMNS[name] == 'q':
+                            column.append(record[name])
+                        else:
+                            value = record.get(name)
+                            column.append(float('nan') if value is None else float(value))
+                    add_to_rollup(meta['week'], week_start(date), record)
+                    add_to_rollup(meta['month'], date.strftime('%Y-%m'), record)
+            self.views = {}
+            for name, column in columns.items():
+                with open(self._column_path(name), 'ab') as file:
+                    if os.fstat(file.fileno()).st_size > meta['rows'] * column.itemsize:  # only when needed, the file may still be mapped
+                        file.truncate(meta['rows'] * column.itemsize)  # drop what an interrupted sync wrote after the last rows
+                    file.write(column.tobytes())
+                    file.flush()
+                    os.fsync(file.fileno())
+            added = len(columns['id'])
+            meta['rows'] += added
+            meta['file_size'] = offset
+            self._write_meta(meta)
+            self.meta = meta
+            return added
+
+    def rebuild(self, source=json_path):
+        with self.lock:
+            self.views = {}
+            self.meta = None
+            for name in COLUMNS:
+                if os.path.exists(self._column_path(name)):
+                    os.remove(self._column_path(name))
+            meta_path = os.path.join(self.path, 'meta.json')
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+        return self.sync(source)
+
+    def column(self, name):
+        # Zero-copy view of the values of a field, in the order of the JSONL file.
+        # A view stays valid after a sync, with the rows it had when it was returned.
+        with self.lock:
+            if self.meta is None:
+                self.meta = self._read_meta()
+            if name not in self.views:
+                rows = self.meta['rows']
+                if not rows:
+                    return memoryview(array(COLUMNS[name]))
+                with open(self._column_path(name), 'rb') as file:
+                    column_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)  # closed with its last view
+                self.views[name] = memoryview(column_map).cast(COLUMNS[name])[:rows]
+            return self.views[name]
+
+    def rollups(self, period, after=None, before=None):
+        # period is 'week' or 'month', after and before are compared with the keys ('YYYY-MM-DD' or 'YYYY-MM')
+        with self.lock:
+            if self.meta is None:
+                self.meta = self._read_meta()
+            rollups = self.meta[period]
+        result = []
+        for key in sorted(rollups):
+            if (after and key < after[:len(key)]) or (before and key >= before[:len(key)]):
+                continue
+            rollup = rollups[key]
+            result.append({
+                period: key,
+                'count': rollup['count'],
+                'distance': rollup['distance'],
+                'moving_time': rollup['moving_time'],
+                'elevation_gain': rollup['elevation_gain'],
+                'average_speed': rollup['distance'] / rollup['moving_time'] if rollup['moving_time'] else None,
+                'average_heartrate': rollup['heartrate_time'] / rollup['heartrate_seconds'] if rollup['heartrate_seconds'] else None,
+            })
+        return result
+
+columns = ColumnStore(columns_path)
+
+def migrate_columns():
+    rows = columns.rebuild(json_path)
+    print(f'{rows} activities converted to columns in {columns_path}')
+
 def get_data():
-    polylines = []
-    dates = []
-    data = []
     try:
-        with jsonlines.open(json_path, mode='r') as reader:
-            for line in reader:
-                date = line['start_date']
-                polyline = line['polyline']
-                polylines.append(polyline)  
-                dates.append(date)
-                data.append(line)
-        return polylines, dates, data
-    except FileNotFoundError:
-        return "No activities found."
+        activities = store.load().activities
+        polylines = [activity['polyline'] for activity in activities]
+        dates = [activity['start_date'] for activity in activities]
+        return polylines, dates, activities
     except Exception as e:
         return str(f'Error: {e} line {e.__traceback__.tb_lineno}')
-    
+
+def cached_response(snapshot, payload_function, variant=''):
+    # JSON response with an ETag built from the snapshot version, the route, the query string,
+    # the variant (what else the payload depends on) and the content coding (-gz),
+    # answered with 304 when it matches If-None-Match, gzipped when the client accepts it
+    gzipped = 'gzip' in request.accept_encodings
+    etag = '{}-{:x}{}{}'.format(snapshot.version, zlib.crc32(request.path.encode() + b'?' + request.query_string), variant, '-gz' if gzipped else '')
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    responses = snapshot.responses
+    key = (request.path, request.query_string, variant, gzipped)
+    body = responses.get(key)
+    if body is None:
+        body = json.dumps(payload_function()).encode()
+        if gzipped:
+            body = gzip.compress(body, compresslevel=6)
+        if len(responses) >= 256:
+            responses.clear()
+        responses[key] = body
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'  # revalidate with the ETag
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@app_flask.route('/api/activities')
+def api_activities():
+    try:
+        data = store.load()
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = min(500, max(1, request.args.get('per_page', 50, type=int)))
+        after = request.args.get('after')
+        before = request.args.get('before')
+        bbox = request.args.get('bbox')
+        if bbox:
+            bbox = [float(value) for value in bbox.split(',')]
+            if len(bbox) != 4:
+                return {'error': 'bbox must be west,south,east,north'}, 400
+
+        def payload():
+            indexes = data.query(after, before, bbox)
+            selected = indexes[(page - 1) * per_page:page * per_page]
+            return {
+                'page': page,
+                'per_page': per_page,
+                'total': len(indexes),
+                'activities': [data.activities[i] for i in selected],
+            }
+
+        return cached_response(data, payload)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    except Exception as e:
+        return {'error': f'Error: {e} line {e.__traceback__.tb_lineno}'}, 500
+
+@app_flask.route('/api/routes')
+def api_routes():
+    # Simplified polylines of the activities visible in bbox, for the map at zoom
+    try:
+        data = store.load()
+        bbox = [float(value) for value in request.args.get('bbox', '').split(',') if value]
+        if len(bbox) != 4:
+            return {'error': 'bbox must be west,south,east,north'}, 400
+        zoom = request.args.get('zoom', SIMPLIFY_ZOOMS[-1] + 1, type=int)
+        after = request.args.get('after')
+        before = request.args.get('before')
+
+        used_zoom, polylines = data.routes(zoom)  # the zoom used changes while the routes are simplified
+
+        def payload():
+            return {
+                'zoom': used_zoom,
+                'routes': [{'id': data.activities[i]['id'], 'start_date': data.dates[i], 'polyline': polylines[i]}
+                           for i in data.query(after, before, bbox)],
+            }
+
+        return cached_response(data, payload, f'-z{used_zoom}')
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    except Exception as e:
+        return {'error': f'Error: {e} line {e.__traceback__.tb_lineno}'}, 500
+
+@app_flask.route('/api/stats')
+def api_stats():
+    # Weekly or monthly totals from the rollups of the column store
+    try:
+        data = store.load()
+        columns.sync(json_path)
+        period = request.args.get('period', 'week')
+        if period not in ('week', 'month'):
+            return {'error': 'period must be week or month'}, 400
+        after = request.args.get('after')
+        before = request.args.get('before')
+        return cached_response(data, lambda: {'period': period, 'rollups': columns.rollups(period, after, before)})
+    except Exception as e:
+        return {'error': f'Error: {e} line {e.__traceback__.tb_lineno}'}, 500
 
 @app_flask.route('/activities')
 def activities():
-    json_path = os.path.join(PATH, 'activities-all.json')
     try:
-        with open(json_path, 'r') as file:
-            data = file.read()
-        return render_template('activities.html', data=data)
-    except FileNotFoundError:
-        return "No activities found."
+        data = store.load()
+        if not data.exists:
+            return "No activities found."
+        return render_template('activities.html', data=data.text())
     except Exception as e:
         return str(f'Error: {e} line {e.__traceback__.tb_lineno}')
 
@@ -156,8 +967,39 @@ def my_runs():
     
 @app_flask.route('/refresh', methods=['GET'])
 def refresh_activities():
-    get_activities()
-    return render_template('refresh.html')
+    job_id = refresh_jobs.submit()
+    return render_template('refresh.html', job_id=job_id)
+
+@app_flask.route('/api/refresh', methods=['POST'])
+def api_refresh():
+    return {'job_id': refresh_jobs.submit()}, 202
+
+@app_flask.route('/api/refresh/<job_id>')
+def api_refresh_status(job_id):
+    job = refresh_jobs.get(job_id)
+    if job is None:
+        return {'error': f'Unknown job {job_id}'}, 404
+    return job.snapshot()[1]
+
+@app_flask.route('/api/refresh/<job_id>/events')
+def api_refresh_events(job_id):
+    # Server-sent events: the status of the job each time it changes, until it is finished
+    job = refresh_jobs.get(job_id)
+    if job is None:
+        return {'error': f'Unknown job {job_id}'}, 404
+
+    def events():
+        version, status = job.snapshot()
+        yield f'data: {json.dumps(status)}\n\n'
+        while status['state'] in ('queued', 'running'):
+            new_version, status = job.wait(version, timeout=15)
+            if new_version == version:
+                yield ': keep-alive\n\n'
+            else:
+                version = new_version
+                yield f'data: {json.dumps(status)}\n\n'
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 if __name__ == '__main__':
     app_flask.run(port=8000, debug=True)
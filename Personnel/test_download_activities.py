@@ -0,0 +1,232 @@
+#python3 -m pytest test_download_activities.py
+# The Strava API is replaced by a local stub server, so no token or network access is needed.
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+for module in ('dotenv', 'jsonlines', 'requests', 'flask', 'fastapi', 'stravalib'):
+    pytest.importorskip(module)
+
+import download_activities
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Answers each path with the next scripted response (the last one is repeated) and logs the requests
+    def do_GET(self):
+        server = self.server
+        path = self.path.split('?')[0]
+        with server.lock:
+            server.log.append((path, self.headers.get('Authorization')))
+            responses = server.responses.get(path) or [(200, {}, {'id': int(path.split('/')[2])})]
+            status, headers, body = responses.pop(0) if len(responses) > 1 else responses[0]
+            if server.valid_token and self.headers.get('Authorization') != f'Bearer {server.valid_token}':
+                status, headers, body = 401, {}, {'message': 'Authorization Error'}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.lock = threading.Lock()
+    server.log = []
+    server.responses = {}
+    server.valid_token = None
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    # An index of 5 activities in a temporary directory
+    monkeypatch.setattr(download_activities, 'json_path', str(tmp_path / 'activities-all.json'))
+    monkeypatch.setattr(download_activities, 'index_path', str(tmp_path / 'activities-index.sqlite'))
+    clock = Clock()
+    monkeypatch.setattr(download_activities.time, 'time', clock.time)
+    monkeypatch.setattr(download_activities.time, 'sleep', clock.sleep)  # no real wait
+    lines = [json.dumps({'id': i, 'start_date': f'2024-01-0{i}T08:00:00+00:00'}) + '\n' for i in range(1, 6)]
+    with open(download_activities.json_path, 'w') as file:
+        file.writelines(lines)
+    return [1, 2, 3, 4, 5]
+
+
+class Clock:
+    # Time that only advances when the code sleeps, from 10:05 UTC
+    def __init__(self):
+        self.now = 1704103500.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def fetched_ids():
+    db = download_activities.open_index()
+    try:
+        return sorted(row[0] for row in db.execute("SELECT id FROM details"))
+    finally:
+        db.close()
+
+
+def test_api_get_retries_429_and_5xx(server, index):
+    server.responses['/activities/1'] = [(429, {}, {}), (503, {}, {}), (200, {}, {'id': 1})]
+    session = download_activities.requests.Session()
+    limiter = download_activities.RateLimiter()
+    assert download_activities.api_get(session, limiter, f'{server.url}/activities/1') == {'id': 1}
+    assert len(server.log) == 3
+
+
+def test_api_get_gives_up_on_4xx(server, index):
+    server.responses['/activities/1'] = [(404, {}, {'message': 'Record Not Found'})]
+    session = download_activities.requests.Session()
+    with pytest.raises(download_activities.requests.HTTPError):
+        download_activities.api_get(session, download_activities.RateLimiter(), f'{server.url}/activities/1')
+    assert len(server.log) == 1
+
+
+def test_read_quota_headers_update_the_limiter(server, index):
+    headers = {'X-RateLimit-Limit': '200,2000', 'X-RateLimit-Usage': '42,500',
+               'X-ReadRateLimit-Limit': '100,1000', 'X-ReadRateLimit-Usage': '40,480'}
+    server.responses['/activities/1'] = [(200, headers, {'id': 1})]
+    limiter = download_activities.RateLimiter()
+    download_activities.api_get(download_activities.requests.Session(), limiter, f'{server.url}/activities/1')
+    assert limiter.limits == [100, 1000]
+    assert limiter.usage == [40, 480]
+
+
+def test_overall_quota_headers_without_read_quota(server, index):
+    server.responses['/activities/1'] = [(200, {'X-RateLimit-Limit': '200,2000', 'X-RateLimit-Usage': '42,500'}, {'id': 1})]
+    limiter = download_activities.RateLimiter()
+    download_activities.api_get(download_activities.requests.Session(), limiter, f'{server.url}/activities/1')
+    assert limiter.limits == [200, 2000]
+    assert limiter.usage == [42, 500]
+
+
+def test_429_waits_for_the_next_window(server, index):
+    server.responses['/activities/1'] = [(429, {}, {}), (200, {}, {'id': 1})]
+    start = download_activities.time.time()
+    download_activities.api_get(download_activities.requests.Session(), download_activities.RateLimiter(), f'{server.url}/activities/1')
+    assert download_activities.time.time() >= start - start % 900 + 900  # 10:15
+    assert len(server.log) == 2
+
+
+def test_limiter_waits_when_the_quota_is_used(monkeypatch):
+    limiter = download_activities.RateLimiter(short_limit=2)
+    limiter.acquire()
+    limiter.acquire()
+
+    def sleep(seconds):
+        raise TimeoutError(seconds)
+
+    monkeypatch.setattr(download_activities.time, 'sleep', sleep)
+    with pytest.raises(TimeoutError):
+        limiter.acquire()
+
+
+def test_fetch_details_resumes(server, index):
+    server.responses['/activities/3'] = [(500, {}, {})]  # fails on every retry
+    fetched, errors = download_activities.fetch_details(base_url=server.url, access_token='token', workers=2)
+    assert (fetched, errors) == (4, 1)
+    assert fetched_ids() == [1, 2, 4, 5]
+
+    server.responses['/activities/3'] = [(200, {}, {'id': 3})]
+    server.log.clear()
+    fetched, errors = download_activities.fetch_details(base_url=server.url, access_token='token', workers=2)
+    assert (fetched, errors) == (1, 0)
+    assert fetched_ids() == index
+    assert {path for path, authorization in server.log} == {'/activities/3', '/activities/3/streams'}
+
+
+def test_fetch_details_refreshes_a_rejected_token(server, index, monkeypatch):
+    # The stored token was revoked before its expiry: the first 401 refreshes it, the requests are sent again
+    class StubClient:
+        access_token = 'old'
+        refresh_token = 'refresh'
+        token_expires_at = float('inf')
+
+        def refresh_access_token(self, **kwargs):
+            return {'access_token': 'new', 'refresh_token': 'refresh', 'expires_at': float('inf')}
+
+    refreshes = []
+    stub_client = StubClient()
+    monkeypatch.setattr(download_activities, 'client', stub_client)
+    monkeypatch.setattr(download_activities, 'client_loaded', True)
+    monkeypatch.setattr(download_activities, 'save_object', lambda obj, path: refreshes.append(obj.access_token))
+    server.valid_token = 'new'
+
+    fetched, errors = download_activities.fetch_details(base_url=server.url, workers=4)
+    assert (fetched, errors) == (5, 0)
+    assert refreshes == ['new']  # refreshed once for all the rejected requests
+    assert stub_client.access_token == 'new'
+
+
+def test_column_views_survive_a_sync(tmp_path, monkeypatch):
+    source = tmp_path / 'activities-all.json'
+    lines = [json.dumps({'id': i, 'start_date': f'2024-01-0{i}T08:00:00+00:00', 'distance': 1000.0 * i}) + '\n' for i in range(1, 4)]
+    source.write_text(''.join(lines))
+    store = download_activities.ColumnStore(str(tmp_path / 'columns'))
+    assert store.sync(str(source)) == 3
+    distance = store.column('distance')
+
+    with open(source, 'a') as file:
+        file.write(json.dumps({'id': 4, 'start_date': '2024-01-04T08:00:00+00:00', 'distance': 4000.0}) + '\n')
+    assert store.sync(str(source)) == 1
+    assert list(distance) == [1000.0, 2000.0, 3000.0]  # the view returned before the sync is still readable
+    assert list(store.column('distance')) == [1000.0, 2000.0, 3000.0, 4000.0]
+
+    monkeypatch.setattr(store, '_read_meta', lambda: pytest.fail('meta.json read again'))
+    assert store.sync(str(source)) == 0  # unchanged file, answered from the meta in memory
+
+
+def test_api_etags_differ_by_content_coding(tmp_path, monkeypatch):
+    source = tmp_path / 'activities-all.json'
+    source.write_text(''.join(json.dumps({'id': i, 'start_date': f'2024-01-0{i}T08:00:00+00:00'}) + '\n' for i in range(1, 4)))
+    monkeypatch.setattr(download_activities, 'store', download_activities.ActivityStore(str(source)))
+    client = download_activities.app_flask.test_client()
+
+    identity = client.get('/api/activities', headers={'Accept-Encoding': 'identity'})
+    gzipped = client.get('/api/activities', headers={'Accept-Encoding': 'gzip'})
+    assert identity.headers['ETag'] != gzipped.headers['ETag']
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    revalidated = client.get('/api/activities', headers={'Accept-Encoding': 'identity', 'If-None-Match': identity.headers['ETag']})
+    assert revalidated.status_code == 304
+
+
+def test_route_simplification_leaves_other_etags(tmp_path, monkeypatch):
+    source = tmp_path / 'activities-all.json'
+    source.write_text(''.join(json.dumps({'id': i, 'start_date': f'2024-01-0{i}T08:00:00+00:00', 'polyline': '_p~iF~ps|U_ulLnnqC_mqNvxq`@'}) + '\n'
+                              for i in range(1, 4)))
+    monkeypatch.setattr(download_activities, 'store', download_activities.ActivityStore(str(source)))
+    client = download_activities.app_flask.test_client()
+
+    before = client.get('/api/activities').headers['ETag']
+    download_activities.store.simplify_routes(download_activities.store.load())  # what the background thread does
+    assert client.get('/api/activities').headers['ETag'] == before
+    routes = client.get('/api/routes?bbox=-180,-90,180,90&zoom=9')
+    assert routes.headers['ETag'].endswith('-z8"')
+    assert routes.get_json()['zoom'] == 8
+    assert len(routes.get_json()['routes']) == 3
+
+
+def test_decode_polylines():
+    polylines = ['_p~iF~ps|U_ulLnnqC_mqNvxq`@', '_p~iF~ps|U_ulL', '', None]  # the second one is truncated
+    decoded = download_activities.decode_polylines(polylines)
+    assert [list(points) for points in decoded] == [[38.5, -120.2, 40.7, -120.95, 43.252, -126.453], [38.5, -120.2], [], []]
+    assert download_activities.encode_polyline(decoded[0]) == polylines[0]
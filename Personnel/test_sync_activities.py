@@ -0,0 +1,108 @@
+#python3 -m pytest test_sync_activities.py
+# The incremental sync of get_activities, with a stub Strava client instead of stravalib.
+
+import json
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import pytest
+
+for module in ('dotenv', 'jsonlines', 'requests', 'flask', 'fastapi', 'stravalib'):
+    pytest.importorskip(module)
+
+import download_activities
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def activity(i):
+    return SimpleNamespace(id=i, distance='5000.0 m', moving_time=timedelta(seconds=1500), elapsed_time=timedelta(seconds=1600),
+                           total_elevation_gain='10.0 m', elev_high=20.0, elev_low=10.0, average_speed='3.3 m/s', max_speed='5.0 m/s',
+                           average_heartrate=150.0, max_heartrate=180.0, calories=300.0, name=f'Run {i}',
+                           start_date=datetime(2024, 1, 1, 8, tzinfo=timezone.utc) + timedelta(days=i),
+                           map=SimpleNamespace(summary_polyline='_p~iF~ps|U_ulLnnqC'))
+
+
+class StubClient:
+    # Like Strava: newest first without after, oldest first after it. fail_after stops the crawl with an error.
+    access_token = 'token'
+    token_expires_at = float('inf')
+
+    def __init__(self, count):
+        self.activities = [activity(i) for i in range(count)]
+        self.afters = []
+        self.fail_after = None
+
+    def get_athlete(self):
+        return SimpleNamespace(id=1)
+
+    def get_activities(self, after=None):
+        self.afters.append(after)
+        if after is None:
+            activities = self.activities[::-1]
+        else:
+            activities = [a for a in self.activities if a.start_date > after]
+        for n, a in enumerate(activities):
+            if self.fail_after is not None and n >= self.fail_after:
+                raise ConnectionError('network down')
+            yield a
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    stub = StubClient(450)
+    monkeypatch.setattr(download_activities, 'client', stub)
+    monkeypatch.setattr(download_activities, 'client_loaded', True)
+    monkeypatch.setattr(download_activities, 'json_path', str(tmp_path / 'activities-all.json'))
+    monkeypatch.setattr(download_activities, 'index_path', str(tmp_path / 'activities-index.sqlite'))
+    monkeypatch.setattr(download_activities, 'columns', download_activities.ColumnStore(str(tmp_path / 'columns')))
+    return stub
+
+
+def saved_ids():
+    with open(download_activities.json_path, 'rb') as file:
+        return [json.loads(line)['id'] for line in file]
+
+
+def test_interrupted_first_crawl_resumes(client):
+    client.fail_after = 250
+    download_activities.get_activities()
+    assert client.afters == [EPOCH]  # oldest first, so what is saved is a prefix of the history
+    assert saved_ids() == list(range(200))  # the complete page is kept, the next one is lost with the error
+
+    client.fail_after = None
+    download_activities.get_activities()
+    assert saved_ids() == list(range(450))
+
+
+def test_second_run_starts_after_the_last_activity(client):
+    download_activities.get_activities()
+    client.activities += [activity(i) for i in range(450, 455)]
+    download_activities.get_activities()
+    assert client.afters[-1] == client.activities[449].start_date
+    assert saved_ids() == list(range(455))
+
+
+def test_partial_last_line_is_dropped(client):
+    download_activities.get_activities()
+    with open(download_activities.json_path, 'a') as file:
+        file.write('{"id": 999999, "dist')  # a crash in the middle of a write
+
+    client.activities += [activity(i) for i in range(450, 455)]
+    download_activities.get_activities()
+    assert saved_ids() == list(range(455))
+    with sqlite3.connect(download_activities.index_path) as db:
+        assert db.execute("SELECT COUNT(*) FROM activities").fetchone()[0] == 455
+    assert len(download_activities.columns.column('id')) == 455
+
+
+def test_index_of_a_previous_version_is_migrated(client):
+    with sqlite3.connect(download_activities.index_path) as db:
+        db.execute("CREATE TABLE activities (id INTEGER PRIMARY KEY, start_date TEXT NOT NULL, offset INTEGER NOT NULL)")
+        db.execute("INSERT INTO activities VALUES (1, '2024-01-02 08:00:00+00:00', 0)")
+    db = download_activities.open_index()
+    try:
+        assert [column[1] for column in db.execute("PRAGMA table_info(activities)")] == ['id', 'start_date']
+        assert db.execute("SELECT id FROM activities").fetchall() == [(1,)]
+    finally:
+        db.close()
@@ -0,0 +1,225 @@
+#! /usr/bin/python3.12
+
+#python3 bench_ip_handling.py --output results.json
+#python3 bench_ip_handling.py --compare results.json --threshold 10
+
+### IMPORTS ###
+
+import argparse
+import gc
+import json
+import platform
+import sys
+import tracemalloc
+from os import urandom
+from time import strftime
+from timeit import Timer
+import ip_handling
+from ip_handling import checksum, checksum_batch, update_checksum, build_echo_datagram, build_packet, PacketTemplate, unpack_response, IPv4Header, iter_packets
+
+
+### CONSTANTS ###
+
+PAYLOAD_SIZES = [0, 64, 1024, 16384, 65507]                                         # 65507 is the largest payload of an IPv4 echo request (Total Length = 20 + 8 + data)
+QUICK_PAYLOAD_SIZES = [0, 1024]
+BATCH_SIZES = [1, 64, 1024]
+QUICK_BATCH_SIZES = [64]
+IDENTIFIER = 0x1234
+
+
+### FUNCTIONS ###
+
+def cases(payload_sizes, batch_sizes):                                              # Function that lists the benchmark cases
+
+    """
+    This function lists the benchmark cases, with two parameters:
+    payload_sizes (the sizes of the data of the echo requests) and batch_sizes (the numbers of packets of the batch functions).
+
+    params:
+    payload_sizes (list): the sizes of the data, in bytes
+    batch_sizes (list): the numbers of packets of the batch functions
+
+    return:
+    generator: the name, the parameters, the function to time and the number of packets it handles
+    """
+
+    for size in payload_sizes:
+        data = urandom(size)
+        datagram = build_echo_datagram(data, IDENTIFIER, 1)
+        packet = build_packet(datagram, IDENTIFIER)
+        template = PacketTemplate(data, IDENTIFIER)
+        params = {"payload": size}
+        yield "checksum", params, lambda packet=packet: checksum(packet), 1
+        yield "build_echo_datagram", params, lambda data=data: build_echo_datagram(data, IDENTIFIER, 1), 1
+        yield "build_packet", params, lambda datagram=datagram: build_packet(datagram, IDENTIFIER), 1
+        yield "PacketTemplate.packet", params, lambda template=template: template.packet(1), 1
+        yield "unpack_response", params, lambda packet=packet: unpack_response(packet), 1
+        yield "IPv4Header", params, lambda packet=packet: IPv4Header(packet).icmp.number, 1
+        for batch in batch_sizes:
+            packets = [packet] * batch
+            buffer = bytes(template.fill(batch))
+            params = {"payload": size, "batch": batch}
+            yield "checksum_batch", params, lambda packets=packets: checksum_batch(packets), batch
+            yield "PacketTemplate.fill", params, lambda template=template, batch=batch: template.fill(batch), batch
+            yield "iter_packets", params, lambda buffer=buffer, size=template.size: sum(1 for header in iter_packets(buffer, size)), batch
+    checksum_value = checksum(b"\x00" * 20)
+    yield "update_checksum", {}, lambda: update_checksum(checksum_value, b"\x00\x40", b"\x00\x3f"), 1
+
+def allocated(function, repeat=5):                                                  # Function that measures the memory allocated by a call
+
+    """
+    This function measures with tracemalloc the allocations of a call of a function, with two parameters:
+    function (the function to call) and repeat (the number of calls averaged). tracemalloc must already be tracing
+    (see traced_allocations). The number of blocks comes from the difference of two snapshots taken around the call
+    while its result is still alive, so it counts the blocks the call leaves allocated (its result and what it caches),
+    not the temporary ones; the peak is the most memory used during the call, so it includes the temporary ones.
+
+    params:
+    function (callable): the function to call
+    repeat (int): the number of calls averaged
+
+    return:
+    tuple: the blocks retained by a call and the peak of memory of a call, in bytes
+    """
+
+    function()                                                                      # the first call may fill caches
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]                     # ignore the memory of tracemalloc itself
+    blocks = 0
+    peak = 0
+    for i in range(repeat):
+        gc.collect()                                                                # free the garbage of the previous measures first
+        before = tracemalloc.take_snapshot().filter_traces(filters)
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        result = function()                                                         # keep the result alive for the second snapshot
+        peak += tracemalloc.get_traced_memory()[1] - current
+        after = tracemalloc.take_snapshot().filter_traces(filters)
+        blocks += sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+        del result
+    return blocks / repeat, peak / repeat
+
+def traced_allocations(functions, repeat=5):                                        # Function that measures the memory allocated by many functions
+
+    """
+    This function measures the allocations of a call of each function, with two parameters: functions (the functions
+    to call) and repeat (the number of calls averaged). tracemalloc is started once, a first measure is discarded
+    (it counts the start-up allocations of tracemalloc), and the measure of an empty call is subtracted from each result.
+
+    params:
+    functions (iterable): the functions to call
+    repeat (int): the number of calls averaged
+
+    return:
+    generator: the blocks retained by a call and the peak of memory of a call of each function, in bytes
+    """
+
+    tracemalloc.start()
+    try:
+        allocated(lambda: None, repeat)                                             # warm-up, discarded
+        base_blocks, base_peak = allocated(lambda: None, repeat)                    # what the measure itself allocates
+        for function in functions:
+            blocks, peak = allocated(function, repeat)
+            yield round(blocks - base_blocks, 2), round(peak - base_peak, 2)
+    finally:
+        tracemalloc.stop()
+
+def run(payload_sizes, batch_sizes, repeat=5):                                      # Function that runs the benchmark cases
+
+    """
+    This function runs the benchmark cases, with three parameters: payload_sizes (the sizes of the data),
+    batch_sizes (the numbers of packets of the batch functions) and repeat (the number of timings of each case).
+    Each case is timed over enough calls to last 0.2 second, and the best of the timings is kept. The allocations
+    are measured after all the timings, so tracemalloc does not slow them down.
+
+    params:
+    payload_sizes (list): the sizes of the data, in bytes
+    batch_sizes (list): the numbers of packets of the batch functions
+    repeat (int): the number of timings of each case
+
+    return:
+    list: the result of each case
+    """
+
+    results = []
+    for name, params, function, packets in cases(payload_sizes, batch_sizes):
+        timer = Timer(function)
+        number = timer.autorange()[0]                                               # the number of calls that last 0.2 second
+        best = min(timer.repeat(repeat, number)) / number                           # the best time of a call, in seconds
+        results.append({
+            "name": name,
+            "params": params,
+            "ns_per_op": best * 1e9,
+            "ns_per_packet": best * 1e9 / packets,
+            "packets_per_s": packets / best,
+        })
+    functions = (function for name, params, function, packets in cases(payload_sizes, batch_sizes))  # the same cases, built again
+    for result, (blocks, peak) in zip(results, traced_allocations(functions)):
+        result["retained_blocks_per_op"] = blocks
+        result["peak_bytes_per_op"] = peak
+        print(f"{key(result):45} {result['ns_per_op']:14.0f} ns/op {result['packets_per_s']:14.0f} packets/s {result['retained_blocks_per_op']:8.1f} retained blocks/op {result['peak_bytes_per_op']:12.0f} peak B/op")
+    return results
+
+def key(result):                                                                    # Function that names a result to compare the runs
+    params = ",".join(f"{name}={value}" for name, value in sorted(result["params"].items()))
+    return f"{result['name']}[{params}]"
+
+def compare(results, baseline, threshold):                                          # Function that compares the results with a previous run
+
+    """
+    This function compares the results with the ones of a previous run, with three parameters:
+    results (the results of this run), baseline (the results of the previous run) and threshold (the slowdown allowed).
+
+    params:
+    results (list): the results of this run
+    baseline (list): the results of the previous run
+    threshold (float): the slowdown allowed, in percent
+
+    return:
+    list: the names of the cases slower than the threshold
+    """
+
+    previous = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:                                                             # a new case
+            continue
+        change = 100 * (result["ns_per_op"] - old["ns_per_op"]) / old["ns_per_op"]
+        flag = "REGRESSION" if change > threshold else ""
+        print(f"{key(result):45} {old['ns_per_op']:14.0f} -> {result['ns_per_op']:14.0f} ns/op {change:+8.1f}% {flag}")
+        if change > threshold:
+            regressions.append(key(result))
+    return regressions
+
+
+### MAIN ###
+
+if __name__ == "__main__":                                                          #if the script is executed directly
+
+    parser = argparse.ArgumentParser(description="Benchmark of the packet build, checksum and parse functions of ip_handling")
+    parser.add_argument("--output", help="JSON file where the results are saved")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=10.0, help="slowdown in percent reported as a regression")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timings of each case")
+    parser.add_argument("--quick", action="store_true", help="run fewer payload and batch sizes")
+    args = parser.parse_args()
+
+    results = run(QUICK_PAYLOAD_SIZES if args.quick else PAYLOAD_SIZES, QUICK_BATCH_SIZES if args.quick else BATCH_SIZES, args.repeat)
+    run_info = {
+        "date": strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "numpy": ip_handling.numpy is not None,
+        "results": results,
+    }
+    if args.output:                                                                 #save the results
+        with open(args.output, "w") as file:
+            json.dump(run_info, file, indent=2)
+        print(f"Results saved in {args.output}")
+    if args.compare:                                                                #compare with a previous run
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions above {args.threshold}%")
+            sys.exit(1)
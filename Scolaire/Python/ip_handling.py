@@ -6,6 +6,31 @@ from struct import *
 from socket import *
 from time import *
 from random import *
+import asyncio
+from array import array
+from sys import platform
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+try:
+    import numpy                                                                    # optional, used to checksum batches of packets
+except ImportError:
+    numpy = None
+
+
+### CONSTANTS ###
+
+_IP_HEADER = Struct(">BBHHHBBH4s4s")                                                # layout of the IP header without options
+_IP_FIELDS = Struct(">HHBBH")                                                       # identifier, flags, TTL, protocol and checksum of the IP header
+_ICMP_FIELDS = Struct(">HHH")                                                       # checksum, identifier and number of the ICMP datagram
+_ICMP_HEADER = Struct(">BBHHh")                                                     # layout of the ICMP header
+_U16 = Struct(">H")                                                                 # a 16 bits field
+_TIMESPEC = Struct("@ll")                                                           # the seconds and nanoseconds of a kernel timestamp
+_ANCILLARY_SIZE = CMSG_SPACE(_TIMESPEC.size) if platform.startswith("linux") else 0 # room for the kernel timestamp of a packet
+SO_TIMESTAMPNS = 35 if platform.startswith("linux") else None                       # not exported by the socket module
+DEFAULT_HOST = "saebut.chalons.univ-reims.fr"                                       # the default destination, resolved when it is used
+CAPTURE_SOURCE = "0.0.0.0"                                                          # source address of the captured requests, the real one is chosen by the kernel
 
 
 ### FUNCTIONS ###
@@ -33,20 +58,97 @@ def init_checksum(packet, protocol):
 def checksum(packet):                                                               # Function that calculates the checksum value                                       
     
     """
-    This function calculates the checksum value of a packet, with a parameter of type bytes.
+    This function calculates the checksum value of a packet (RFC 1071), with a parameter of type bytes.
+    The whole buffer is summed at once instead of two bytes at a time, and an odd-length
+    packet is padded with a zero byte as the RFC requires.
     
     params:
-    packet (bytes): the packet
+    packet (bytes): the packet (bytes, bytearray or memoryview)
     
     return:
     bytes: the checksum value in network byte order
     """
 
-    sum = 0x0000                                                                    #Set the value of the checksum to 0
-    for i in range(0, len(packet), 2):                                              #For each byte in the packet
-        sum += (packet[i] << 8) + packet[i+1]                                       # Add the two bytes at index i and i+1 to the sum
-    sum = ~((sum & 0xffff) + (sum >> 16)) & 0xffff                                  # If the sum is greater than 16 bits, add the carry to the sum                                             
-    return pack(">H", sum)                                                          # Return the checksum value in network byte order
+    sum = word_sum(packet)                                                          # one's complement sum of the 16 bits words of the packet
+    return pack(">H", ~sum & 0xffff)                                                # Return the checksum value in network byte order
+
+def word_sum(packet):                                                               # Function that calculates the one's complement sum of a packet
+    
+    """
+    This function calculates the one's complement sum of the 16 bits words of a packet, with a parameter of type bytes.
+    The packet is read as one big integer: as 2**16 = 1 (mod 0xffff), its value modulo 0xffff is
+    the sum of its words with the carries added back, which is done in C in a single pass.
+    
+    params:
+    packet (bytes): the packet (bytes, bytearray or memoryview)
+    
+    return:
+    int: the folded sum, between 0 and 0xffff
+    """
+
+    if len(packet) % 2:                                                             # if the length of the packet is odd
+        packet = bytes(packet) + b"\x00"                                            # pad the packet with a zero byte
+    value = int.from_bytes(packet, "big")                                           # the whole packet as a big endian integer
+    sum = value % 0xffff                                                            # the sum of the words with the carries added back
+    if sum == 0 and value != 0:                                                     # a non null sum is never 0 in one's complement
+        sum = 0xffff
+    return sum                                                                      # return the folded sum
+
+def checksum_batch(packets):                                                        # Function that calculates the checksum value of many packets
+    
+    """
+    This function calculates the checksum value of many packets in one call, with a parameter of type list.
+    When numpy is installed and the packets have the same length, the words of all the packets are
+    summed at once in a 2D array, else each packet goes through the bulk path of checksum.
+    
+    params:
+    packets (list): the packets (bytes, bytearray or memoryview)
+    
+    return:
+    list: the checksum values in network byte order, in the same order as the packets
+    """
+
+    packets = list(packets)                                                         # the packets may be given as a generator
+    if numpy is None or len(packets) < 2 or len({len(p) for p in packets}) != 1:    # if numpy is missing or the packets have different lengths
+        return [checksum(p) for p in packets]                                       # checksum each packet
+    length = len(packets[0])                                                        # the common length of the packets
+    buffer = b"".join(packets)                                                      # the packets in one contiguous buffer
+    if length % 2:                                                                  # if the length of the packets is odd
+        words = numpy.zeros((len(packets), length + 1), dtype=numpy.uint8)          # pad each packet with a zero byte
+        words[:, :length] = numpy.frombuffer(buffer, dtype=numpy.uint8).reshape(len(packets), length)
+        length += 1
+        buffer = words.tobytes()
+    words = numpy.frombuffer(buffer, dtype=">u2").reshape(len(packets), length // 2)  # one row of big endian words per packet
+    sums = words.sum(axis=1, dtype=numpy.uint64)                                    # sum the words of each packet
+    while (sums >> 16).any():                                                       # while there is a carry
+        sums = (sums & 0xffff) + (sums >> 16)                                       # add the carry to the sum
+    return [pack(">H", ~int(sum) & 0xffff) for sum in sums]                         # return the checksum values in network byte order
+
+def update_checksum(old_checksum, old_field, new_field):                            # Function that updates a checksum value after a field has changed
+    
+    """
+    This function updates the checksum value of a packet after a field of the packet has changed (RFC 1624),
+    with three parameters: old_checksum (the checksum value of the packet), old_field (the old value of the field)
+    and new_field (the new value of the field). The packet is not summed again: HC' = ~(~HC + ~m + m').
+    The fields must be aligned on 16 bits words, for example the TTL is given with the protocol byte.
+    
+    params:
+    old_checksum (bytes): the checksum value of the packet in network byte order
+    old_field (bytes): the old value of the field in network byte order
+    new_field (bytes): the new value of the field in network byte order
+    
+    return:
+    bytes: the new checksum value in network byte order
+    """
+
+    if len(old_field) != len(new_field):                                            # the field must keep its length
+        raise ValueError("old_field and new_field must have the same length")
+    sum = ~unpack(">H", old_checksum)[0] & 0xffff                                   # ~HC
+    sum += 0xffff - word_sum(old_field)                                             # + ~m
+    sum += word_sum(new_field)                                                      # + m'
+    while sum >> 16:                                                                # while there is a carry
+        sum = (sum & 0xffff) + (sum >> 16)                                          # add the carry to the sum
+    return pack(">H", ~sum & 0xffff)                                                # Return the checksum value in network byte order
 
 def build_echo_datagram(data, identifier, number):                                  # Function that builds the ICMP datagram for the echo request
     
@@ -63,15 +165,10 @@ def build_echo_datagram(data, identifier, number):
     bytes: the ICMP datagram
     """
     
-    identifier_number_bytes = pack(">Hh", identifier, number)                                   # Concatenation of the identifier and the number of the ICMP datagram    
-    Type = pack("b", 8)                                                                         #value for echo 
-    Code = pack("b", 0)                                                                         #default value                       
-    data_bytes = b""                                                                            #set the value of the data to an empty byte string                             
-    for i in data:                                                                              #for each character in the data               
-        data_bytes += pack("b", i)                                                              #convert the character to a byte string and add it to the data byte string                                
-    icmp_checksum = checksum(Type + Code + b"\x00\x00" + identifier_number_bytes + data_bytes)  #checksum value of the ICMP datagram
-    text = Type + Code + icmp_checksum + identifier_number_bytes + data_bytes                   #concatenation of the ICMP datagram
-    return text                                                                                 #return the ICMP datagram                            
+    header = pack(">BBHHh", 8, 0, 0, identifier, number)                                        # type (8 for echo), code, checksum set to 0, identifier and number
+    data_bytes = bytes(data)                                                                    # the data converted to bytes in one copy
+    icmp_checksum = checksum(header + data_bytes)                                               # checksum value of the ICMP datagram
+    return header[:2] + icmp_checksum + header[4:] + data_bytes                                 # return the ICMP datagram with its checksum
 
 def build_packet(datagram, identifier, ttl=64, protocole=1, header_checksum=0, ip_source="127.0.0.1", ip_dest="127.0.0.1", options=0, padding=0):                          # Function that builds the packet with the ICMP datagram and the IP header
 
@@ -97,73 +194,705 @@ def build_packet(datagram, identifier, ttl=64, protocole=1, header_checksum=0, i
     """
 
     version = 0x4                                                                                                                                                           # in hexadecimal value for the first byte of the IP header
-    ihl = 0x5                                                                                                                                                               # in hexadecimal value for the first byte of the IP header          
-    version_ihl = pack("b", (version << 4 & 0xf0) + (ihl & 0x0f))                                                                                                           # concatenation of version and ihl in one byte                               
-    type_of_service = pack("b", 0)                                                                                                                                          # default value
-    total_length = pack(">H", 28 + len(datagram))                                                                                                                           # length of the IP header + length of the ICMP datagram
-    flags_fragment_offset = pack(">h", (1416*(len(datagram)//1416)//8))                                                                                                     # calculate the number of fragments                                         
-    ttl = pack("B", ttl)                                                                                                                                                    # value defined by the user                                                          
-    protocole = pack("b", protocole)                                                                                                                                        # value defined by the user
-    identifier = pack(">H", identifier)                                                                                                                                     # value defined by the user
-    ip_source = inet_aton(ip_source)                                                                                                                                        # value defined by the user                             
-    ip_dest = inet_aton(ip_dest)                                                                                                                                            # value defined by the user             
-    header_checksum = checksum(version_ihl + type_of_service + total_length + identifier + flags_fragment_offset + ttl + protocole + b"\x00\x00" + ip_source + ip_dest)     # checksum value of the IP header
-    
-    ip_header =  version_ihl + type_of_service + total_length + identifier + flags_fragment_offset + ttl + protocole + header_checksum + ip_source + ip_dest                                                                                                                                                      # if there is no options                              
-    packet = ip_header + datagram                                                                                                                                           # concatenation of the IP header and the ICMP datagram
+    header_length = 32 if options != 0 else 20                                                                                                                             # the options and their padding fill the header up to 32 bytes
+    ihl = header_length // 4                                                                                                                                                # length of the IP header in 32 bits words
+    version_ihl = (version << 4 & 0xf0) + (ihl & 0x0f)                                                                                                                      # concatenation of version and ihl in one byte                               
+    total_length = header_length + len(datagram)                                                                                                                            # length of the IP header + length of the ICMP datagram (with its 8 bytes header)
+    flags_fragment_offset = 1416*(len(datagram)//1416)//8                                                                                                                   # calculate the number of fragments                                         
+    ip_header = bytearray(header_length)                                                                                                                                    # the IP header, packed in one call, the padding is already 0
+    _IP_HEADER.pack_into(ip_header, 0, version_ihl, 0, total_length, identifier, flags_fragment_offset, ttl, protocole, 0, inet_aton(ip_source), inet_aton(ip_dest))
     if options != 0:                                                                                                                                                        # if there is options                                                      
-        options = pack("B", options)                                                                                                                                        # options converted to bytes                             
-        padding = b"\x00" * (32-len(ip_header))                                                                                                                             # padding to fill the IP header                          
-        packet = ip_header + options + padding + datagram                                                                                                                   # concatenation of the IP header and the ICMP datagram
-    return  packet                                                                                                                                                          # return the packet                                                                   
+        ip_header[20] = options                                                                                                                                             # options after the fixed part of the header
+    ip_header[10:12] = checksum(ip_header)                                                                                                                                  # checksum value of the IP header, options included
+    return bytes(ip_header) + datagram                                                                                                                                      # concatenation of the IP header and the ICMP datagram
+
+class PacketTemplate:                                                               # Class that builds echo request packets from a precompiled template
+
+    """
+    This class compiles the IPv4/ICMP layout of an echo request once into a preallocated bytearray, with six parameters:
+    data (the data to send), identifier (the identifier of the ICMP datagram and of the IP header), ttl (the time to live),
+    ip_source (the source IP address), ip_dest (the destination IP address) and options (the options of the IP header).
+    Each packet then only patches the fields that change (identifier, number, TTL, destination and the checksums)
+    with pack_into, and the checksums are added to sums precomputed with these fields set to 0 (RFC 1624).
+    The packets are the same as the ones built by build_echo_datagram and build_packet.
+
+    params:
+    data (bytes): the data to send
+    identifier (int): the identifier of the ICMP datagram and of the IP header
+    ttl (int): the time to live
+    ip_source (str): the source IP address
+    ip_dest (str): the destination IP address
+    options (int): the options of the IP header
+    """
+
+    def __init__(self, data=b"", identifier=0, ttl=64, ip_source="127.0.0.1", ip_dest="127.0.0.1", options=0):
+
+        datagram = build_echo_datagram(data, 0, 0)                                  # the ICMP datagram with the variable fields set to 0
+        self.buffer = bytearray(build_packet(datagram, 0, 0, ip_source=ip_source, ip_dest="0.0.0.0", options=options))  # the preallocated packet
+        self.view = memoryview(self.buffer)                                         # view on the packet, to return it without copy
+        self.size = len(self.buffer)                                                # the length of a packet
+        self.offset = self.size - len(datagram)                                     # the index of the ICMP datagram in the packet
+        self.buffer[10:12] = b"\x00\x00"                                            # set the checksum values of the IP header and of the ICMP datagram to 0
+        self.buffer[self.offset+2:self.offset+4] = b"\x00\x00"
+        self._ip_sum = word_sum(self.view[:self.offset])                            # sum of the IP header (options included) without the variable fields
+        self._icmp_sum = word_sum(self.view[self.offset:])                          # sum of the ICMP datagram without the variable fields
+        self._flags, self._protocole = unpack_from(">HxB", self.buffer, 6)          # the fields of the IP header that are packed with the variable ones
+        self.identifier = identifier
+        self.ttl = ttl
+        self.ip_dest = ip_dest
+        self.packet(0)                                                              # patch the template with the first packet
+
+    @property
+    def ip_dest(self):                                                              # the destination IP address as a string
+        return inet_ntoa(self._ip_dest)
+
+    @ip_dest.setter
+    def ip_dest(self, ip_dest):                                                     # the destination IP address is converted to bytes once
+        self._ip_dest = inet_aton(ip_dest)
+        self._ip_dest_sum = word_sum(self._ip_dest)
+
+    def _ip_checksum(self):                                                         # checksum value of the IP header for the current fields
+        sum = self._ip_sum + self.identifier + (self.ttl << 8) + self._ip_dest_sum
+        sum = (sum & 0xffff) + (sum >> 16)                                          # add the carry to the sum, twice is enough for 4 words
+        sum = (sum & 0xffff) + (sum >> 16)
+        return ~sum & 0xffff
+
+    def _icmp_checksum(self, number):                                               # checksum value of the ICMP datagram for the current fields
+        sum = self._icmp_sum + self.identifier + number
+        sum = (sum & 0xffff) + (sum >> 16)                                          # add the carry to the sum, twice is enough for 3 words
+        sum = (sum & 0xffff) + (sum >> 16)
+        return ~sum & 0xffff
+
+    def packet(self, number, identifier=None, ttl=None, ip_dest=None):              # Method that patches the template and returns the packet
+
+        """
+        This method patches the template with the fields of a packet and returns the packet, with four parameters:
+        number (the number of the ICMP datagram), identifier, ttl and ip_dest (the new values of these fields, if given).
+        The returned memoryview is the template itself, so it changes at the next call.
+
+        params:
+        number (int): the number of the ICMP datagram
+        identifier (int): the identifier of the ICMP datagram and of the IP header
+        ttl (int): the time to live
+        ip_dest (str): the destination IP address
+
+        return:
+        memoryview: the packet
+        """
+
+        if identifier is not None:
+            self.identifier = identifier & 0xffff
+        if ttl is not None:
+            self.ttl = ttl
+        if ip_dest is not None:
+            self.ip_dest = ip_dest
+        number &= 0xffff                                                            # the number is a 16 bits field
+        _IP_FIELDS.pack_into(self.buffer, 4, self.identifier, self._flags, self.ttl, self._protocole, self._ip_checksum())
+        self.buffer[16:20] = self._ip_dest
+        _ICMP_FIELDS.pack_into(self.buffer, self.offset + 2, self._icmp_checksum(number), self.identifier, number)
+        return self.view
 
-def send_packet(packet, ip_dest=gethostbyname("saebut.chalons.univ-reims.fr")):     # Function that sends the packet to the destination
+    def datagram(self, number, identifier=None):                                    # Method that patches the template and returns the ICMP datagram
+
+        """
+        This method patches the template and returns the ICMP datagram only, for the sockets that build the IP header
+        themselves (like the one of send_ping), with two parameters: number (the number of the ICMP datagram)
+        and identifier (the new identifier, if given).
+
+        params:
+        number (int): the number of the ICMP datagram
+        identifier (int): the identifier of the ICMP datagram
+
+        return:
+        memoryview: the ICMP datagram
+        """
+
+        return self.packet(number, identifier)[self.offset:]
+
+    def fill(self, count, start=0, out=None):                                       # Method that fills a buffer with many packets
+
+        """
+        This method fills a contiguous buffer with count packets numbered from start, with three parameters:
+        count (the number of packets), start (the number of the first packet) and out (a preallocated buffer to reuse).
+        The IP header is the same for the whole burst, so only the number and the ICMP checksum are patched in each copy.
+        The packet i is at buffer[i*size:(i+1)*size].
+
+        params:
+        count (int): the number of packets
+        start (int): the number of the first packet
+        out (bytearray): a buffer of at least count*size bytes, a new one is allocated if not given
+
+        return:
+        memoryview: the buffer with the packets
+        """
+
+        self.packet(start)                                                          # patch the template with the first packet
+        size = self.size
+        if out is None:
+            out = self.buffer * count                                               # copy the template count times in one allocation
+        else:
+            if len(out) < count * size:
+                raise ValueError(f"the buffer must hold {count * size} bytes")
+            for i in range(count):                                                  # copy the template in each slot of the buffer
+                out[i*size:(i+1)*size] = self.buffer
+        offset = self.offset + 2                                                    # index of the ICMP checksum in the first packet
+        for i in range(1, count):                                                   # the first packet is already patched
+            number = (start + i) & 0xffff
+            _ICMP_FIELDS.pack_into(out, offset + i*size, self._icmp_checksum(number), self.identifier, number)
+        return memoryview(out)[:count*size]
+
+class Resolver:                                                                     # Class that resolves domain names with a cache
+
+    """
+    This class resolves domain names to IP addresses and keeps the results in a cache, with three parameters:
+    ttl (the time an address is kept), negative_ttl (the time a failed resolution is kept) and max_size (the number of names kept).
+    gethostbyname gives no TTL, so the same TTL is used for every name. The least recently used names are evicted
+    when the cache is full, and the cache can be shared between threads.
+
+    params:
+    ttl (float): the time an address is kept, in seconds
+    negative_ttl (float): the time a failed resolution is kept, in seconds
+    max_size (int): the number of names kept
+    """
+
+    def __init__(self, ttl=300, negative_ttl=30, max_size=4096):
+
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.cache = OrderedDict()                                                  # name -> (address or error, expiry time)
+        self.lock = Lock()
+
+    def _store(self, name, result, ttl):                                            # Method that adds a result to the cache
+        with self.lock:
+            self.cache[name] = (result, monotonic() + ttl)
+            self.cache.move_to_end(name)
+            while len(self.cache) > self.max_size:                                  # evict the least recently used names
+                self.cache.popitem(last=False)
+
+    def _lookup(self, name):                                                        # Method that returns the cached result of a name, or None
+        with self.lock:
+            entry = self.cache.get(name)
+            if entry is None:
+                return None
+            if entry[1] < monotonic():                                              # the result has expired
+                del self.cache[name]
+                return None
+            self.cache.move_to_end(name)
+            return entry[0]
+
+    def resolve(self, name):                                                        # Method that resolves a domain name
+
+        """
+        This method resolves a domain name to an IP address, with one parameter: name (the domain name or the IP address).
+        An IP address is returned as is, without lookup.
+
+        params:
+        name (str): the domain name or the IP address
+
+        return:
+        str: the IP address
+        """
+
+        try:
+            inet_pton(AF_INET, name)                                                # an IP address needs no lookup
+            return name
+        except OSError:
+            pass
+        result = self._lookup(name)
+        if result is None:                                                          # not in the cache
+            try:
+                result = gethostbyname(name)
+                self._store(name, result, self.ttl)
+            except gaierror as error:                                               # remember the failure too
+                result = error
+                self._store(name, result, self.negative_ttl)
+        if isinstance(result, gaierror):
+            raise gaierror(*result.args)
+        return result
+
+    def resolve_many(self, names, workers=32):                                      # Method that resolves many domain names in parallel
+
+        """
+        This method resolves many domain names in parallel on a thread pool, with two parameters:
+        names (the domain names or IP addresses) and workers (the number of threads). The names that are
+        already in the cache are not looked up again.
+
+        params:
+        names (list): the domain names or IP addresses
+        workers (int): the number of threads
+
+        return:
+        dict: the IP address of each name, None if it can not be resolved
+        """
+
+        def resolve(name):
+            try:
+                return self.resolve(name)
+            except gaierror:
+                return None
+
+        names = list(dict.fromkeys(names))                                          # each name is resolved once
+        addresses = {}
+        missing = []
+        for name in names:                                                          # the cached names are answered without thread
+            result = self._lookup(name)
+            if result is None:
+                missing.append(name)
+            else:
+                addresses[name] = None if isinstance(result, gaierror) else result
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(workers, len(missing))) as pool:
+                addresses.update(zip(missing, pool.map(resolve, missing)))
+        return addresses
+
+    def clear(self):                                                                # Method that empties the cache
+        with self.lock:
+            self.cache.clear()
+
+resolver = Resolver()                                                               # the resolver used by the functions of this module
+
+def send_packet(packet, ip_dest=DEFAULT_HOST):                                      # Function that sends the packet to the destination
     
     """
     This function sends the packet to the destination, with two parameters:
-    packet (the packet to send) and ip_dest (the destination IP address or domain name, by default the IP address of "saebut.chalons.univ-reims.fr").
+    packet (the packet to send) and ip_dest (the destination IP address or domain name, by default "saebut.chalons.univ-reims.fr").
     
     params:
     packet (bytes): the packet to send
-    ip_dest (str): the destination IP address or domain name, default value is the IP address of "saebut.chalons.univ-reims.fr"
+    ip_dest (str): the destination IP address or domain name, default value is "saebut.chalons.univ-reims.fr", resolved when the function is called
     
     return:
     None
     """
 
-    ip_dest = gethostbyname(ip_dest)                                                #get the IP address of the destination if it is a domain name, else return the IP address
+    ip_dest = resolver.resolve(ip_dest)                                             #get the IP address of the destination if it is a domain name, else return the IP address
     rawSocket = socket(AF_INET, SOCK_RAW, IPPROTO_RAW)                              #create a raw socket
     rawSocket.sendto(packet, (ip_dest,0))                                           #send the packet to the destination
     rawSocket.close()                                                               #close the socket
 
-def send_ping(datagram, ip_dest=gethostbyname("saebut.chalons.univ-reims.fr")):     # Function that sends the packet to the destination and receive the response
+def open_ping_socket():                                                             # Function that opens a socket for the echo requests
+
+    """
+    This function opens a raw ICMP socket and asks the kernel for the receive time of each packet (SO_TIMESTAMPNS)
+    when the system supports it.
+
+    return:
+    socket: the raw socket
+    """
+
+    rawSocket = socket(AF_INET, SOCK_RAW, IPPROTO_ICMP)                             #create a raw socket
+    if SO_TIMESTAMPNS is not None:                                                  #if the kernel can timestamp the received packets
+        try:
+            rawSocket.setsockopt(SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        except OSError:                                                             #the timestamps are optional
+            pass
+    return rawSocket
+
+def exchange(rawSocket, datagram, ip_dest, timeout=1.0, capture=None):              # Function that sends an echo request and waits for its reply
+
+    """
+    This function sends an echo request and waits for the reply with the same identifier and number, with five parameters:
+    rawSocket (the socket from open_ping_socket), datagram (the ICMP datagram), ip_dest (the destination IP address),
+    timeout (the time to wait for the reply) and capture (a PcapWriter that records the request and the reply). The round-trip time is measured with perf_counter_ns, or with
+    the kernel receive time when the socket gives it, so the time spent to wake up the program is not counted.
+
+    params:
+    rawSocket (socket): the socket from open_ping_socket
+    datagram (bytes): the ICMP datagram
+    ip_dest (str): the destination IP address
+    timeout (float): the time to wait for the reply, in seconds
+    capture (PcapWriter): the writer that records the packets, the request is given an IP header for the capture
+
+    return:
+    tuple: the received packet, the address of the destination and the round-trip time in nanoseconds (int)
+    """
+
+    request = ICMPHeader(datagram)
+    identifier, number = request.identifier, request.number                         #the fields of the reply to wait for
+    deadline = perf_counter() + timeout
+    sent_wall = time_ns()                                                           #the time of the request, on the clock of the kernel timestamps
+    sent = perf_counter_ns()                                                        #the time of the request
+    rawSocket.sendto(datagram, (ip_dest,0))                                         #send the packet to the destination
+    if capture is not None:                                                         #record the request with the IP header added by the kernel
+        capture.write(build_packet(bytes(datagram), identifier, ip_source=CAPTURE_SOURCE, ip_dest=ip_dest), sent_wall)
+    while True:
+        remaining = deadline - perf_counter()
+        if remaining <= 0:
+            raise TimeoutError(f"no reply from {ip_dest}")
+        rawSocket.settimeout(remaining)
+        recv_packet, ancdata, flags, addr = rawSocket.recvmsg(65535, _ANCILLARY_SIZE) #receive the packet and its timestamp
+        received = perf_counter_ns()                                                #the time of the reply
+        reply = IPv4Header(recv_packet).icmp
+        if reply.type != 0 or reply.identifier != identifier or reply.number != number:  #not the reply to this request
+            continue
+        rtt = received - sent
+        received_wall = None
+        for level, type, value in ancdata:
+            if level == SOL_SOCKET and type == SO_TIMESTAMPNS and len(value) >= _TIMESPEC.size:
+                seconds, nanoseconds = _TIMESPEC.unpack_from(value)
+                received_wall = seconds * 1_000_000_000 + nanoseconds
+                kernel_rtt = received_wall - sent_wall
+                if 0 < kernel_rtt <= rtt:                                           #ignore the timestamp if the wall clock has moved
+                    rtt = kernel_rtt
+        if capture is not None:                                                     #record the reply
+            capture.write(recv_packet, received_wall)
+        return recv_packet, addr, rtt
+
+def send_ping(datagram, ip_dest=DEFAULT_HOST, timeout=1.0, capture=None):           # Function that sends the packet to the destination and receive the response
   
     """
-    This function sends the packet to the destination and receive the response, with two parameters:
-    datagram (the ICMP datagram) and ip_dest (the destination IP address, by default the IP address of "saebut.chalons.univ-reims.fr").
+    This function sends the packet to the destination and receive the response, with four parameters:
+    datagram (the ICMP datagram), ip_dest (the destination IP address, by default "saebut.chalons.univ-reims.fr"),
+    timeout (the time to wait for the response) and capture (a PcapWriter that records the packets). Only the echo reply with the identifier and the number
+    of the datagram is accepted.
     
     params:
     datagram (bytes): the ICMP datagram
-    ip_dest (str): the destination IP address, default value is the IP address of "saebut.chalons.univ-reims.fr"
+    ip_dest (str): the destination IP address, default value is "saebut.chalons.univ-reims.fr", resolved when the function is called
+    timeout (float): the time to wait for the response, in seconds, TimeoutError is raised after it
+    capture (PcapWriter): the writer that records the packets
     
     return:
-    tuple: the received packet, the address of the destination, the response and the time in milliseconds
+    tuple: the received packet, the address of the destination, the response and the round-trip time in nanoseconds (int)
     """
 
-    time_ms = time()                                                                #get the time in milliseconds
-    ip_dest = gethostbyname(ip_dest)                                                #get the IP address of the destination if it is a domain name, else return the IP address
-    rawSocket = socket(AF_INET, SOCK_RAW, IPPROTO_ICMP)                             #create a raw socket
-    rawSocket.sendto(datagram, (ip_dest,0))                                         #send the packet to the destination
-    recv_packet, addr = rawSocket.recvfrom(1024)                                    #receive the packet from the destination
+    ip_dest = resolver.resolve(ip_dest)                                             #get the IP address of the destination if it is a domain name, else return the IP address
+    rawSocket = open_ping_socket()                                                  #create a raw socket
+    try:
+        recv_packet, addr, rtt = exchange(rawSocket, datagram, ip_dest, timeout, capture)  #send the packet and receive the response
+    finally:
+        rawSocket.close()                                                           #close the socket 
     response = unpack_response(recv_packet)                                         #unpack the response
-    rawSocket.close()                                                               #close the socket 
-    return recv_packet, addr,  response, time_ms                                    #return the received packet, the address of the destination, the response and the time in milliseconds
+    return recv_packet, addr, response, rtt                                         #return the received packet, the address of the destination, the response and the time in nanoseconds
+
+def ping(ip_dest=DEFAULT_HOST, count=None, interval=1.0, timeout=1.0, data=b"abcdefghijklmnopqrstuvwabcdefghi", histogram=None, capture=None):  # Function that pings a destination continuously
+
+    """
+    This function pings a destination every interval seconds, like the ping command, with seven parameters:
+    ip_dest (the destination), count (the number of requests, None to never stop), interval (the time between two requests),
+    timeout (the time to wait for each reply), data (the data of the requests) and histogram (a LatencyHistogram
+    that records every round-trip time) and capture (a PcapWriter that records the packets). The same socket is used for all the requests.
+
+    params:
+    ip_dest (str): the destination IP address or domain name
+    count (int): the number of requests, None to never stop
+    interval (float): the time between two requests, in seconds
+    timeout (float): the time to wait for each reply, in seconds
+    data (bytes): the data of the requests
+    histogram (LatencyHistogram): the histogram that records the round-trip times
+    capture (PcapWriter): the writer that records the packets
+
+    return:
+    generator: the number of each request and its round-trip time in nanoseconds (int), None if there is no reply
+    """
+
+    ip_dest = resolver.resolve(ip_dest)
+    template = PacketTemplate(data, randint(0, 65535))                              #the template of the requests
+    rawSocket = open_ping_socket()
+    try:
+        number = 0
+        next_time = perf_counter()
+        while count is None or number < count:
+            try:
+                rtt = exchange(rawSocket, template.datagram(number), ip_dest, timeout, capture)[2]
+            except TimeoutError:                                                    #the request is lost
+                rtt = None
+            if histogram is not None:
+                histogram.record(rtt)
+            yield number, rtt
+            number += 1
+            next_time += interval
+            delay = next_time - perf_counter()
+            if delay > 0 and (count is None or number < count):                    #wait for the time of the next request
+                sleep(delay)
+    finally:
+        rawSocket.close()
+
+class LatencyHistogram:                                                             # Class that computes latency statistics in a fixed memory
+
+    """
+    This class records round-trip times in a log-linear histogram (like HDR Histogram) and computes the statistics
+    of a ping (min, average, percentiles, max, jitter and loss) without keeping the samples, with two parameters:
+    max_value (the highest time recorded, in nanoseconds) and precision (the number of bits of each bucket).
+    The values below 2**precision are exact, the others are rounded to 1 part in 2**(precision-1).
+    The round-trip times of exchange, send_ping, ping and PingSweeper are all integer nanoseconds, so they are recorded as they are;
+    only summary converts them to milliseconds.
+
+    params:
+    max_value (int): the highest time recorded, in nanoseconds, the higher ones are counted in the last bucket
+    precision (int): the number of bits of each bucket, 7 gives 1.6% of error
+    """
+
+    def __init__(self, max_value=60_000_000_000, precision=7):
+
+        self.precision = precision
+        self.sub_count = 1 << precision                                             #the number of exact values
+        self.half = self.sub_count >> 1                                             #the number of values of each power of 2 after them
+        buckets = max(0, max_value.bit_length() - precision)
+        self.counts = array("Q", bytes(8 * (self.sub_count + buckets * self.half))) #the count of each bucket
+        self.sent = 0
+        self.received = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.jitter = 0.0                                                           #the jitter in nanoseconds (RFC 3550)
+        self.last = None
+
+    def _index(self, value):                                                        # Method that returns the bucket of a value
+        if value < self.sub_count:
+            return value
+        shift = value.bit_length() - self.precision
+        return min(self.sub_count + (shift - 1) * self.half + (value >> shift) - self.half, len(self.counts) - 1)
+
+    def _value(self, index):                                                        # Method that returns the middle of a bucket
+        if index < self.sub_count:
+            return index
+        shift = (index - self.sub_count) // self.half + 1
+        return ((index - self.sub_count) % self.half + self.half << shift) + (1 << shift >> 1)
+
+    def record(self, value):                                                        # Method that records a round-trip time
+
+        """
+        This method records a round-trip time, with one parameter: value (the time in nanoseconds, None if the request is lost).
+
+        params:
+        value (int): the round-trip time in nanoseconds, None if the request is lost
+        """
+
+        self.sent += 1
+        if value is None:                                                           #the request is lost
+            return
+        value = max(int(value), 0)
+        self.received += 1
+        self.total += value
+        self.counts[self._index(value)] += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.last is not None:                                                   #J = J + (|D| - J) / 16
+            self.jitter += (abs(value - self.last) - self.jitter) / 16
+        self.last = value
+
+    def percentile(self, percent):                                                  # Method that returns a percentile of the round-trip times
+
+        """
+        This method returns a percentile of the recorded round-trip times, with one parameter: percent (between 0 and 100).
+
+        params:
+        percent (float): the percentile, between 0 and 100
+
+        return:
+        int: the round-trip time in nanoseconds, None if nothing is recorded
+        """
+
+        if not self.received:
+            return None
+        rank = max(1, -(-self.received * percent // 100))                           #the rank of the value, rounded up
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def summary(self):                                                              # Method that returns the statistics in milliseconds
+
+        """
+        This method returns the statistics of the recorded round-trip times.
+
+        return:
+        dict: the number of requests sent and received, the loss in percent and the min, avg, p50, p99, max and jitter in milliseconds
+        """
+
+        def ms(value):
+            return None if value is None else value / 1e6
+
+        return {
+            'sent': self.sent,
+            'received': self.received,
+            'loss': 100 * (self.sent - self.received) / self.sent if self.sent else 0.0,
+            'min': ms(self.min),
+            'avg': ms(self.total / self.received) if self.received else None,
+            'p50': ms(self.percentile(50)),
+            'p99': ms(self.percentile(99)),
+            'max': ms(self.max),
+            'jitter': ms(self.jitter) if self.received else None,
+        }
+
+class IPv4Header:                                                                   # Class that reads the fields of an IP header without copy
+
+    """
+    This class is a view on an IP packet, with one parameter: buffer (the packet).
+    The buffer is not copied and each field is only decoded when it is read. The IHL is used to find
+    the options and the ICMP datagram, so the header may be longer than 20 bytes.
+
+    params:
+    buffer (bytes): the packet (bytes, bytearray or memoryview)
+    """
+
+    __slots__ = ("buffer",)
+
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+
+    @property
+    def version(self):                                                              # the 4 high bits of the first byte
+        return self.buffer[0] >> 4
+
+    @property
+    def ihl(self):                                                                  # the 4 low bits of the first byte, in 32 bits words
+        return self.buffer[0] & 0x0f
+
+    @property
+    def length(self):                                                               # the length of the header in bytes
+        return (self.buffer[0] & 0x0f) * 4
+
+    @property
+    def type_of_service(self):
+        return self.buffer[1]
+
+    @property
+    def total_length(self):
+        return _U16.unpack_from(self.buffer, 2)[0]
+
+    @property
+    def identifier(self):
+        return _U16.unpack_from(self.buffer, 4)[0]
+
+    @property
+    def flags(self):                                                                # the flags and the fragment offset
+        return _U16.unpack_from(self.buffer, 6)[0]
+
+    @property
+    def ttl(self):
+        return self.buffer[8]
+
+    @property
+    def protocol(self):
+        return self.buffer[9]
+
+    @property
+    def checksum(self):
+        return _U16.unpack_from(self.buffer, 10)[0]
+
+    @property
+    def source(self):                                                               # the source IP address as a string
+        return inet_ntoa(self.buffer[12:16])
+
+    @property
+    def destination(self):                                                          # the destination IP address as a string
+        return inet_ntoa(self.buffer[16:20])
+
+    @property
+    def options(self):                                                              # the options, empty if the header is 20 bytes long
+        return self.buffer[20:self.length]
+
+    @property
+    def payload(self):                                                              # the datagram after the header
+        return self.buffer[self.length:]
+
+    @property
+    def icmp(self):                                                                 # the ICMP datagram after the header
+        return ICMPHeader(self.buffer[self.length:])
+
+    def to_dict(self):                                                              # Method that returns the fields as unpack_response did
+        version_ihl, type_of_service, total_length, identifier, flags, ttl, protocol, checksum, source, destination = _IP_HEADER.unpack_from(self.buffer)
+        return {
+            'Version': version_ihl >> 4,
+            'IHL': version_ihl & 0x0f,
+            'Type of service': type_of_service,
+            'Total Length': total_length,
+            'ID': identifier,
+            'Flags': flags,
+            'TTL': ttl,
+            'Protocol': protocol,
+            'Checksum': hex(checksum),
+            'Source IP': inet_ntoa(source),
+            'Destination IP': inet_ntoa(destination),
+        }
+
+class ICMPHeader:                                                                   # Class that reads the fields of an ICMP header without copy
+
+    """
+    This class is a view on an ICMP datagram, with one parameter: buffer (the datagram).
+    The buffer is not copied and each field is only decoded when it is read.
+
+    params:
+    buffer (bytes): the ICMP datagram (bytes, bytearray or memoryview)
+    """
+
+    __slots__ = ("buffer",)
+
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+
+    @property
+    def type(self):
+        return self.buffer[0]
+
+    @property
+    def code(self):
+        return self.buffer[1]
+
+    @property
+    def checksum(self):
+        return _U16.unpack_from(self.buffer, 2)[0]
+
+    @property
+    def identifier(self):
+        return _U16.unpack_from(self.buffer, 4)[0]
+
+    @property
+    def number(self):                                                               # the number as an unsigned value
+        return _U16.unpack_from(self.buffer, 6)[0]
+
+    @property
+    def data(self):                                                                 # the data after the header
+        return self.buffer[8:]
+
+    def to_dict(self):                                                              # Method that returns the fields as unpack_response did
+        type, code, checksum, identifier, number = _ICMP_HEADER.unpack_from(self.buffer)
+        return {
+            'Type': type,
+            'Code': code,
+            'Checksum': hex(checksum),
+            'Identifier': identifier,
+            'Number': number,
+        }
+
+def iter_packets(buffer, size=None):                                                # Function that walks a buffer with many packets
+
+    """
+    This function walks a buffer that holds many IP packets one after the other and yields a view on each of them,
+    with two parameters: buffer (the packets) and size (the length of each packet). Without size, the Total Length
+    of each header gives the start of the next packet. No packet is copied.
+
+    params:
+    buffer (bytes): the packets (bytes, bytearray or memoryview)
+    size (int): the length of each packet, to skip reading the Total Length when all the packets have the same (like the ones of PacketTemplate.fill)
+
+    return:
+    generator: the IPv4Header of each packet
+    """
+
+    view = memoryview(buffer)
+    offset = 0
+    end = len(view)
+    while end - offset >= 20:                                                       # while there is room for a header
+        length = size or _U16.unpack_from(view, offset + 2)[0]                      # the length of the packet
+        if length < (view[offset] & 0x0f) * 4 or offset + length > end:
+            raise ValueError(f"truncated packet at offset {offset}")
+        yield IPv4Header(view[offset:offset + length])
+        offset += length
 
 def unpack_response(datagram):                                                      # Function that unpacks the response from the destination
     
     """
     This function unpacks the response from the destination, with one parameter:
-    datagram (the ICMP datagram).
+    datagram (the ICMP datagram). It is kept for the code that uses dictionaries, IPv4Header
+    reads the same fields without building them.
     
     params:
     datagram (bytes): the ICMP datagram
@@ -172,21 +901,150 @@ def unpack_response(datagram):
     tuple: the IP header and the ICMP datagram
     """
 
-    ip_name = ['IHL', 'Type of service', 'Total Length', 'ID', 'Flags', 'TTL', 'Protocol', 'Checksum', 'Source IP', 'Destination IP']       # list of the names of the fields of the IP header
-    icmp_name = ['Type', 'Code', 'Checksum', 'Identifier', 'Number']                                                                        # list of the names of the fields of the IP header and the ICMP datagram               
+    ip_header = IPv4Header(datagram)                                                # view on the IP header
+    return ip_header.to_dict(), ip_header.icmp.to_dict()                            # return the IP header and the ICMP datagram as a tuple
+
+class PingSweeper:                                                                  # Class that pings many destinations with one raw socket
+
+    """
+    This class pings many destinations concurrently with asyncio, with six parameters:
+    data (the data of the echo requests), timeout (the time to wait for each reply), rate (the number of requests sent per second),
+    window (the number of requests waiting for a reply at the same time), identifier (the identifier of the ICMP datagrams)
+    and capture (a PcapWriter that records the packets).
+    All the probes share one raw ICMP socket, the datagrams come from a PacketTemplate and the replies
+    are matched to the waiting probes by their identifier and number.
+
+    params:
+    data (bytes): the data of the echo requests
+    timeout (float): the time to wait for each reply, in seconds
+    rate (float): the number of requests sent per second, None for no limit
+    window (int): the number of requests waiting for a reply at the same time
+    identifier (int): the identifier of the ICMP datagrams, random by default
+    capture (PcapWriter): the writer that records the requests (with the source address CAPTURE_SOURCE, like exchange) and the replies
+    """
+
+    def __init__(self, data=b"", timeout=1.0, rate=1000, window=256, identifier=None, capture=None):
+
+        if identifier is None:
+            identifier = randint(0, 65535)                                          # a random identifier, to ignore the replies to other programs
+        self.identifier = identifier
+        self.template = PacketTemplate(data, identifier, ip_source=CAPTURE_SOURCE)  # the template of the echo requests, its IP header is only used by the capture
+        self.timeout = timeout
+        self.rate = rate
+        self.window = min(window, 65535)                                            # the numbers of the waiting probes must be different
+        self.number = 0                                                             # the number of the next echo request
+        self.pending = {}                                                           # the waiting probes, (identifier, number) -> future
+        self.socket = None
+        self.capture = capture
+
+    def open(self):                                                                 # Method that opens the shared socket
+        if self.socket is None:
+            self.socket = socket(AF_INET, SOCK_RAW, IPPROTO_ICMP)                   # create a raw socket
+            self.socket.setblocking(False)                                          # the socket is used by the event loop
+            self.socket.setsockopt(SOL_SOCKET, SO_RCVBUF, 1 << 20)                  # room for the replies of a whole window
+        return self.socket
+
+    def close(self):                                                                # Method that closes the shared socket
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def _on_readable(self):                                                         # Method called by the event loop when replies are received
+        while True:
+            try:
+                recv_packet, addr = self.socket.recvfrom(65535)                     # receive the packet from the destination
+            except (BlockingIOError, InterruptedError):                             # no more packet to read
+                return
+            received = perf_counter_ns()                                            # the time of the reply
+            if self.capture is not None:                                            # record the reply
+                self.capture.write(recv_packet)
+            icmp_header = IPv4Header(recv_packet).icmp                              # view on the ICMP datagram
+            if icmp_header.type != 0:                                               # not an echo reply (the requests are also received on the loopback)
+                continue
+            future = self.pending.get((icmp_header.identifier, icmp_header.number))
+            if future is not None and not future.done():                            # a reply to a waiting probe
+                future.set_result(received)
+
+    async def _wait(self, key, future, sent, window):                               # Method that waits for the reply of one probe
+        try:
+            received = await asyncio.wait_for(future, self.timeout)                 # wait for the reply or the timeout
+            if received is None:                                                    # the request could not be sent
+                return None
+            return received - sent                                                  # the round-trip time in nanoseconds
+        except TimeoutError:                                                        # no reply in time
+            return None
+        finally:
+            del self.pending[key]                                                   # the probe is no longer waiting
+            window.release()                                                        # let the next probe be sent
+
+    async def sweep(self, targets):                                                 # Method that pings a list of destinations
+
+        """
+        This method pings a list of destinations and waits for the replies, with one parameter:
+        targets (the destination IP addresses or domain names). The domain names are resolved in parallel
+        before the first request is sent.
+
+        params:
+        targets (list): the destination IP addresses or domain names
+
+        return:
+        list: the (destination, round-trip time in nanoseconds (int) or None if there is no reply) tuples, in the order of the targets
+        """
+
+        targets = list(targets)                                                     # the targets may be given as a generator
+        loop = asyncio.get_running_loop()
+        addresses = await loop.run_in_executor(None, resolver.resolve_many, targets)  # resolve all the domain names before the sweep
+        sock = self.open()
+        loop.add_reader(sock.fileno(), self._on_readable)                           # the replies are read as soon as they arrive
+        window = asyncio.Semaphore(self.window)
+        tasks = []
+        start = perf_counter()
+        try:
+            for index, target in enumerate(targets):
+                await window.acquire()                                              # wait for a free place in the window
+                if self.rate:                                                       # wait for the time of the request
+                    delay = start + index / self.rate - perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                number = self.number
+                self.number = (number + 1) & 0xffff
+                key = (self.identifier, number)
+                future = loop.create_future()
+                self.pending[key] = future
+                sent = perf_counter_ns()                                            # the time of the request
+                try:
+                    if addresses[target] is None:                                   # the domain name can not be resolved
+                        raise OSError(f"can not resolve {target}")
+                    await loop.sock_sendto(sock, self.template.datagram(number), (addresses[target], 0))  # send the echo request
+                    if self.capture is not None:                                    # record the request
+                        self.capture.write(self.template.packet(number, ip_dest=addresses[target]))
+                except OSError:                                                     # the destination can not be reached
+                    future.set_result(None)
+                tasks.append(loop.create_task(self._wait(key, future, sent, window)))
+            rtts = await asyncio.gather(*tasks)                                     # wait for all the replies
+        finally:
+            loop.remove_reader(sock.fileno())
+        return list(zip(targets, rtts))
+
+def ping_sweep(targets, **kwargs):                                                  # Function that pings a list of destinations
+
+    """
+    This function pings a list of destinations with a PingSweeper, with two parameters:
+    targets (the destination IP addresses or domain names) and kwargs (the parameters of the PingSweeper).
+
+    params:
+    targets (list): the destination IP addresses or domain names
+    kwargs (dict): the parameters of the PingSweeper (data, timeout, rate, window, identifier, capture)
 
-    ip_header = {
-        'Version': datagram[0] >> 4,                                                #shift the first byte of the datagram to the right by 4 bits to get the version
-    }
-    ip_header.update(dict(zip(ip_name, unpack(">BBHHHBBH4s4s", datagram[:20]))))    #unpack the IP header and add the values to the dictionary
-    icmp_header = dict(zip(icmp_name, unpack(">BBHHh", datagram[20:28])))           #unpack the ICMP datagram and add the values to the dictionary
-    ip_header['IHL'] = unpack(">B", datagram[:1])[0] & 0xF                          #get the IHL value from the first byte of the datagram
-    ip_header['Checksum'] = hex(ip_header['Checksum'])                              #convert the checksum value to hexadecimal
-    ip_header['Source IP'] = inet_ntoa(datagram[12:16])                             #convert the source IP address to a string
-    ip_header['Destination IP'] = inet_ntoa(datagram[16:20])                        #convert the destination IP address to a string 
-    icmp_header['Checksum'] = hex(icmp_header['Checksum'])                          #convert the checksum value to hexadecimal    
+    return:
+    list: the (destination, round-trip time in nanoseconds (int) or None) tuples
+    """
 
-    return ip_header, icmp_header                                                   #return the IP header and the ICMP datagram as a tuple                     
+    sweeper = PingSweeper(**kwargs)
+    try:
+        return asyncio.run(sweeper.sweep(targets))
+    finally:
+        sweeper.close()
 
 ### MAIN ###
 
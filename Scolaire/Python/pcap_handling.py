@@ -0,0 +1,176 @@
+#! /usr/bin/python3.12
+
+### IMPORTS ###
+
+from struct import *
+from time import *
+from mmap import mmap, ACCESS_READ
+from ip_handling import IPv4Header
+
+
+### CONSTANTS ###
+
+MAGIC_NS = 0xa1b23c4d                                                               # magic number of the pcap files with nanosecond timestamps
+MAGIC_US = 0xa1b2c3d4                                                               # magic number of the pcap files with microsecond timestamps
+LINKTYPE_RAW = 101                                                                  # the packets start with their IP header
+LINKTYPE_IPV4 = 228                                                                 # the packets are IPv4 packets
+_FILE_HEADER = Struct("<IHHiIII")                                                   # magic, version, time zone, accuracy, snaplen and link type
+_RECORD_HEADER = Struct("<IIII")                                                    # seconds, fraction of second, captured length and original length
+
+
+### CLASSES ###
+
+class PcapWriter:                                                                   # Class that writes packets in a pcap file
+
+    """
+    This class writes IP packets in a pcap file (link type RAW, nanosecond timestamps), with three parameters:
+    filename (the pcap file), snaplen (the maximum length kept for each packet) and buffer_size (the size of the write buffer).
+    The packets are added to a buffer and written to the file in bulk when it is full.
+
+    params:
+    filename (str): the pcap file
+    snaplen (int): the maximum length kept for each packet
+    buffer_size (int): the number of bytes kept in memory before writing them
+    """
+
+    def __init__(self, filename, snaplen=65535, buffer_size=1 << 20):
+
+        self.file = open(filename, "wb", buffering=0)                               # the file is written by the buffer of this class
+        self.snaplen = snaplen
+        self.buffer_size = buffer_size
+        self.buffer = bytearray(_FILE_HEADER.pack(MAGIC_NS, 2, 4, 0, 0, snaplen, LINKTYPE_RAW))  # the header of the file
+        self.count = 0                                                              # the number of packets written
+
+    def write(self, packet, timestamp=None):                                        # Method that writes a packet
+
+        """
+        This method writes a packet, with two parameters: packet (the IP packet) and timestamp (the time of the packet).
+
+        params:
+        packet (bytes): the IP packet (bytes, bytearray or memoryview)
+        timestamp (int): the time of the packet in nanoseconds since the epoch, now by default
+        """
+
+        if timestamp is None:
+            timestamp = time_ns()
+        seconds, nanoseconds = divmod(timestamp, 1_000_000_000)
+        length = len(packet)
+        captured = min(length, self.snaplen)
+        self.buffer += _RECORD_HEADER.pack(seconds, nanoseconds, captured, length)
+        self.buffer += packet[:captured]
+        self.count += 1
+        if len(self.buffer) >= self.buffer_size:                                    # write the buffer when it is full
+            self.flush()
+
+    def write_many(self, packets, timestamp=None):                                  # Method that writes many packets
+
+        """
+        This method writes many packets with the same timestamp, with two parameters: packets (the IP packets)
+        and timestamp (the time of the packets).
+
+        params:
+        packets (list): the IP packets
+        timestamp (int): the time of the packets in nanoseconds since the epoch, now by default
+        """
+
+        if timestamp is None:
+            timestamp = time_ns()
+        for packet in packets:
+            self.write(packet, timestamp)
+
+    def flush(self):                                                                # Method that writes the buffer to the file
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.buffer.clear()
+
+    def close(self):                                                                # Method that writes the buffer and closes the file
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class PcapReader:                                                                   # Class that reads the packets of a pcap file
+
+    """
+    This class reads the packets of a pcap file, with one parameter: filename (the pcap file).
+    The file is memory-mapped, so a capture larger than the memory can be read, and the packets
+    are returned as memoryviews on the file, without copy. The views must be released before close.
+
+    params:
+    filename (str): the pcap file
+    """
+
+    def __init__(self, filename):
+
+        with open(filename, "rb") as file:
+            self.map = mmap(file.fileno(), 0, access=ACCESS_READ)                   # the file mapped in memory
+        self.view = memoryview(self.map)
+        if len(self.view) < _FILE_HEADER.size:
+            self.close()
+            raise ValueError(f"{filename} is not a pcap file")
+        for byte_order in "<>":                                                     # the byte order of the machine that wrote the file
+            magic = unpack_from(byte_order + "I", self.view)[0]
+            if magic in (MAGIC_NS, MAGIC_US):
+                break
+        else:
+            self.close()
+            raise ValueError(f"{filename} is not a pcap file")
+        self.scale = 1 if magic == MAGIC_NS else 1000                               # nanoseconds in a unit of the fraction of second
+        self.record_header = Struct(byte_order + "IIII")
+        self.linktype = unpack_from(byte_order + "I", self.view, 20)[0]
+
+    def __iter__(self):                                                             # Method that yields the timestamp and the data of each packet
+
+        """
+        This method walks the file and yields each packet.
+
+        return:
+        generator: the time of each packet in nanoseconds since the epoch and the packet as a memoryview
+        """
+
+        view = self.view
+        record_header = self.record_header
+        header_size = record_header.size
+        scale = self.scale
+        offset = _FILE_HEADER.size
+        end = len(view)
+        while end - offset >= header_size:
+            seconds, fraction, captured, length = record_header.unpack_from(view, offset)
+            offset += header_size
+            if offset + captured > end:                                             # the last packet was not completely written
+                return
+            yield seconds * 1_000_000_000 + fraction * scale, view[offset:offset + captured]
+            offset += captured
+
+    def headers(self):                                                              # Method that yields a view on the IP header of each packet
+
+        """
+        This method walks the file and yields each packet as an IPv4Header, to replay a capture through the parser.
+        Only the captures whose packets start with their IP header (link type RAW or IPV4) can be read this way,
+        ValueError is raised for the others (an Ethernet capture of tcpdump for example).
+
+        return:
+        generator: the time of each packet in nanoseconds since the epoch and its IPv4Header
+        """
+
+        if self.linktype not in (LINKTYPE_RAW, LINKTYPE_IPV4):                       # the packets start with a link-layer header
+            raise ValueError(f"link type {self.linktype} is not supported, the packets must start with their IP header")
+        return ((timestamp, IPv4Header(packet)) for timestamp, packet in self)
+
+    def close(self):                                                                # Method that unmaps the file
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:                                                         # packets are still used, the file is unmapped with them
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
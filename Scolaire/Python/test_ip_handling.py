@@ -0,0 +1,135 @@
+#python3 -m pytest test_ip_handling.py
+# The checksums against the algorithm of the first version, the packet templates against build_packet,
+# and a sweep of the loopback network when raw sockets can be opened.
+
+from random import Random
+from socket import socket, AF_INET, SOCK_RAW, IPPROTO_ICMP
+from struct import pack
+import pytest
+
+from ip_handling import checksum, checksum_batch, update_checksum, build_echo_datagram, build_packet, PacketTemplate, iter_packets, ping_sweep
+
+
+def old_checksum(packet):
+    # The checksum of the first version: the words summed two bytes at a time and the carry added back once
+    sum = 0x0000
+    for i in range(0, len(packet), 2):
+        sum += (packet[i] << 8) + packet[i+1]
+    sum = ~((sum & 0xffff) + (sum >> 16)) & 0xffff
+    return pack(">H", sum)
+
+
+def word_total(packet):
+    # The sum of the 16 bits words, without adding the carries back
+    return sum((packet[i] << 8) + packet[i+1] for i in range(0, len(packet), 2))
+
+
+def folded_checksum(packet):
+    # RFC 1071 with the carries added back until there is none
+    total = word_total(packet)
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return pack(">H", ~total & 0xffff)
+
+
+def single_fold_carries(packet):
+    # True when adding the carry back once leaves a new carry, the case the first version got wrong
+    total = word_total(packet)
+    return (total & 0xffff) + (total >> 16) > 0xffff
+
+
+def random_packets(count, seed=0):
+    random = Random(seed)
+    for i in range(count):
+        length = 2 * random.randint(0, 600)
+        if i % 4 == 0:                                                              # packets of 0xff bytes give large sums and carries
+            yield bytes([0xff] * (length - 2)) + random.randbytes(min(2, length))
+        else:
+            yield random.randbytes(length)
+
+
+def test_checksum_matches_the_first_version_on_even_lengths():
+    for packet in random_packets(2000):
+        if single_fold_carries(packet):
+            assert checksum(packet) == folded_checksum(packet)
+        else:
+            assert checksum(packet) == old_checksum(packet)
+
+
+def test_checksum_adds_back_the_last_carry():
+    packet = b"\xff\xff\xff\xff\x00\x01"                                            # 0x1ffff, folded once: 0x10000
+    assert single_fold_carries(packet)
+    assert old_checksum(packet) == b"\xff\xff"                                      # the first version dropped the carry
+    assert checksum(packet) == folded_checksum(packet) == b"\xff\xfe"
+
+
+def test_checksum_pads_odd_lengths():
+    for packet in random_packets(200, seed=1):
+        assert checksum(packet + b"\x2a") == checksum(packet + b"\x2a\x00")
+
+
+def test_checksum_accepts_buffers():
+    packet = bytes(range(256)) * 3
+    assert checksum(bytearray(packet)) == checksum(memoryview(packet)) == checksum(packet)
+
+
+def test_checksum_batch():
+    packets = list(random_packets(100, seed=2))
+    assert checksum_batch(packets) == [checksum(packet) for packet in packets]
+    same_length = [Random(i).randbytes(61) for i in range(50)]
+    assert checksum_batch(same_length) == [checksum(packet) for packet in same_length]
+
+
+def test_update_checksum_matches_a_recompute():
+    random = Random(3)
+    for i in range(2000):
+        header = bytearray(random.randbytes(20))
+        header[10:12] = b"\x00\x00"
+        header[10:12] = checksum(header)
+        offset = 2 * random.randrange(10)
+        if offset == 10:                                                            # the checksum field itself
+            continue
+        old_field = bytes(header[offset:offset + 2])
+        new_field = random.randbytes(2)
+        header[offset:offset + 2] = new_field
+        updated = update_checksum(bytes(header[10:12]), old_field, new_field)
+        header[10:12] = b"\x00\x00"
+        assert updated == checksum(header)
+        header[10:12] = updated
+
+
+@pytest.mark.parametrize("options", [0, 0x94])
+@pytest.mark.parametrize("data", [b"", b"abcdefghijklmnopqrstuvwabcdefghi", bytes(range(256)) * 4])
+def test_packet_template_matches_build_packet(data, options):
+    template = PacketTemplate(data, 0x1234, ip_dest="10.0.0.1", options=options)
+    for number in (0, 1, 0x7fff, 0xffff):
+        datagram = build_echo_datagram(data, 0x1234, number - 0x10000 if number > 0x7fff else number)
+        assert bytes(template.packet(number)) == build_packet(datagram, 0x1234, ip_dest="10.0.0.1", options=options)
+        assert bytes(template.datagram(number)) == datagram
+    datagram = build_echo_datagram(data, 0x4321, 5)
+    assert bytes(template.packet(5, identifier=0x4321, ttl=3, ip_dest="192.168.1.9")) == build_packet(datagram, 0x4321, ttl=3, ip_dest="192.168.1.9", options=options)
+
+
+def test_fill_and_iter_packets():
+    template = PacketTemplate(b"data", 7)
+    buffer = template.fill(100, start=65500)
+    expected = [build_packet(build_echo_datagram(b"data", 7, (number & 0xffff) - 0x10000 if number & 0x8000 else number & 0xffff), 7)
+                for number in range(65500, 65600)]
+    assert [bytes(header.buffer) for header in iter_packets(buffer)] == expected   # walked by Total Length
+    assert [bytes(header.buffer) for header in iter_packets(buffer, template.size)] == expected
+
+
+def raw_sockets():
+    try:
+        socket(AF_INET, SOCK_RAW, IPPROTO_ICMP).close()
+    except OSError:
+        return False
+    return True
+
+
+@pytest.mark.skipif(not raw_sockets(), reason="raw sockets need root or CAP_NET_RAW")
+def test_ping_sweep_of_the_loopback_network():
+    targets = [f"127.0.{i // 250}.{i % 250 + 1}" for i in range(1000)]              # every address of 127.0.0.0/8 is the loopback
+    results = ping_sweep(targets, timeout=2.0, rate=None, window=256)
+    assert [target for target, rtt in results] == targets
+    assert all(isinstance(rtt, int) and rtt > 0 for target, rtt in results)